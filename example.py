@@ -36,5 +36,9 @@ import turtle
 # t.step(9)
 # t.draw().done()
 
+# rewriting and drawing in a background thread, <Escape> to cancel
+# t = PlotD0LTkinter(angle=25.7, lsystem=D0Lsystem('X', {'X': 'F[+X][-X]FX', 'F': 'FF'}))
+# t.draw_async(10).done()
+
 t = PlotD0LTkinter(angle=25.7, lsystem=D0Lsystem('X', {'X': 'F[+X][-X]FX', 'F': 'FF'}))
 t.step(10).draw().done()
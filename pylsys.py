@@ -8,8 +8,18 @@ Classes graph:
 
     BaseLsystem: (abstract) Base for L-System grammar
         +- D0Lsystem: Determinist, context-free Lsystem grammar
+            +- RLED0Lsystem: D0Lsystem with a run-length encoded state
     Plot: (abstract) Base plot for L-System classes
         +- PlotD0LTurtle: plot with turtle for Determinist, context-free Lsystem grammar
+        +- PlotD0LTkinter: plot with a Tkinter Canvas
+        +- PlotD0LSvg: plot in a SVG document, without graphic display
+        +- PlotD0LTiles: plot in a directory of PNG tiles, in parallel
+        +- PlotD0L3D: plot in 3D, exported in OBJ or PLY
+        +- PlotD0LMatplotlib: plot in a matplotlib LineCollection
+    Stats: per-phase timings and counters of Lsystem and Plot
+    AngleSweep: segments and bounding boxes of a state for many angles
+    Geometry: segments of a state in NumPy arrays over one buffer
+    SegmentIndex: uniform grid over a Geometry for point and rectangle queries
 
 masterzu, 2014
 """ 
@@ -20,14 +30,150 @@ VERSION = 1
 # - initial version
 
 import math
+import time
+import json
+import collections
+
+def _peak_memory():
+    """
+    peak resident memory of the process in kilobytes since its start
+    (ru_maxrss), or None if unknown
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    import sys
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on Mac OS X, kilobytes elsewhere
+    if sys.platform == 'darwin':
+        peak //= 1024
+    return peak
+
+
+class Stats:
+    """
+    Record timings and counters of Lsystem and Plot instances
+
+    Phases:
+        rewrite: application of the rules by step
+        bbox: calculation of the bounding box
+        interpretation: transformation of the state in segments
+        backend: submission of the segments to turtle, Tk, ...
+
+    Counters:
+        symbols: number of interpreted symbols
+        segments: number of drawn segments, a run of `F` is one segment
+        max_stack_depth: maximum depth of `[` branching
+
+    Each generation of a Lsystem records its rewrite time, its number of
+    symbols and peak_memory: the high-water mark of the resident memory
+    of the process (in kilobytes) when the generation is recorded, which
+    never decreases, so it is not the peak of this generation alone.
+
+    callback is called with (kind, record) for each new record, with kind
+    one of 'phase', 'counter' or 'generation'.
+
+    >>> s = Stats()
+    >>> s.add('bbox', 0.5)
+    >>> s.add('bbox', 0.25)
+    >>> s.phases['bbox']
+    {'calls': 2, 'time': 0.75}
+    >>> s.count('segments', 3)
+    >>> s.count('segments', 2)
+    >>> s.maximum('max_stack_depth', 4)
+    >>> s.maximum('max_stack_depth', 2)
+    >>> sorted(s.counters.items())
+    [('max_stack_depth', 4), ('segments', 5)]
+    >>> l = D0Lsystem('F', {'F': 'F[+F]F'}, stats=s)
+    >>> l.step(2)
+    'F[+F]F[+F[+F]F]F[+F]F'
+    >>> [g['symbols'] for g in s.generations]
+    [6, 21]
+    >>> s.phases['rewrite']['calls']
+    2
+    >>> sorted(json.loads(s.to_json()).keys())
+    [u'counters', u'generations', u'phases']
+    """
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.reset()
+
+    def reset(self):
+        """
+        forget all the records
+        """
+        self.phases = {}
+        self.counters = {}
+        self.generations = []
+
+    def add(self, name, seconds):
+        """
+        add a call of `seconds` to the phase `name`
+        """
+        p = self.phases.setdefault(name, {'calls': 0, 'time': 0.0})
+        p['calls'] += 1
+        p['time'] += seconds
+        if self.callback is not None:
+            self.callback('phase', {'name': name, 'time': seconds})
+
+    def count(self, name, value=1):
+        """
+        increment the counter `name` of `value`
+        """
+        self.counters[name] = self.counters.get(name, 0) + value
+        if self.callback is not None:
+            self.callback('counter', {'name': name, 'value': value})
+
+    def maximum(self, name, value):
+        """
+        keep the maximum of `value` in the counter `name`
+        """
+        self.counters[name] = max(self.counters.get(name, value), value)
+        if self.callback is not None:
+            self.callback('counter', {'name': name, 'value': value})
+
+    def generation(self, generation, seconds, symbols):
+        """
+        record a new generation of a Lsystem
+        """
+        g = {
+            'generation': generation,
+            'time': seconds,
+            'symbols': symbols,
+            'peak_memory': _peak_memory(),
+        }
+        self.generations.append(g)
+        if self.callback is not None:
+            self.callback('generation', g)
+
+    def as_dict(self):
+        """
+        Returns:
+            dict of phases, counters and generations
+        """
+        return {
+            'phases': self.phases,
+            'counters': self.counters,
+            'generations': self.generations,
+        }
+
+    def to_json(self, **kargs):
+        """
+        Returns:
+            the records as a JSON string; kargs are given to json.dumps
+        """
+        return json.dumps(self.as_dict(), **kargs)
+
 
 class BaseLsystem:
     """
     The abstract class for L-system
     """
-    def __init__(self, axiom, rules, plot=None):
+    def __init__(self, axiom, rules, plot=None, stats=None):
         """
         init func with plot instance of type Plot
+        and optional stats instance of type Stats
 
         rules tests must be made on subclasses
 
@@ -49,6 +195,7 @@ class BaseLsystem:
         self.axiom = axiom
         self.rules = rules
         self._plot = plot
+        self.stats = stats
 
         # check axiom
         self._check_axiom()
@@ -103,6 +250,17 @@ class BaseLsystem:
         """
         return self._current_state
 
+    def compact_state(self):
+        """
+        return current state in its storage form for the interpreters:
+        a string, or a list of runs (symbol, count)
+
+        >>> l = BaseLsystem('F', '')
+        >>> l.compact_state()
+        'F'
+        """
+        return self._current_state
+
 
     def plot(self, plot=None):
         """
@@ -145,6 +303,17 @@ class BaseLsystem:
         """
         raise NotImplementedError
 
+    def skip(self, count=1):
+        """
+        advance count generations for the plots which only need the
+        generation, subclasses may not derive the state
+
+        Returns:
+            the new generation
+        """
+        self.step(count)
+        return self.generation
+
     def evolute(self, nb_gen):
         """
         Generator of nb_gen next generation
@@ -153,7 +322,7 @@ class BaseLsystem:
         """
         for i in xrange(nb_gen):
             self.step()
-            yield self._current_state
+            yield self.state()
 
 
 class D0Lsystem(BaseLsystem):
@@ -163,12 +332,13 @@ class D0Lsystem(BaseLsystem):
     Works with all string, so with D0L branching rules.
 
     """
-    def __init__(self, axiom, rules, plot=None):
+    def __init__(self, axiom, rules, plot=None, stats=None):
         """
         Args:
         axiom : string
         rules : dict(character: string)
         plot: instance of Plot subclass
+        stats: instance of Stats to profile the rewriting
 
         >>> D0Lsystem('F','')
         Traceback (most recent call last):
@@ -180,13 +350,20 @@ class D0Lsystem(BaseLsystem):
         TypeError: rules must be a non empty dict
         >>> l = D0Lsystem('Q',{1: 2})
         """
-        BaseLsystem.__init__(self, axiom, rules, plot)
+        BaseLsystem.__init__(self, axiom, rules, plot, stats)
 
         # check rules is a dict
         self._check_rules()
 
         self.finished = False
 
+        # derivation: (symbol, depth) -> symbol rewritten depth times, for
+        # the symbols with a rule and the depths 1, 2, 4, 8 ... and their
+        # sums, forgotten at the end of a step, and copy of the rules of
+        # the expansions
+        self._expansions = {}
+        self._expansion_rules = dict(rules)
+
     def _check_rules(self):
         if not isinstance(self.rules, {}.__class__):
             raise TypeError('rules must be a non empty dict')
@@ -215,19 +392,65 @@ class D0Lsystem(BaseLsystem):
         for r in self.rules.keys():
             s += "| %s -> %s\n" % (r, self.rules[r])
         s += "+--\n"
-        if self._current_state is None:
+        if self.state() is None:
             s += "= (none)"
         else:
-            s += "= %s" % str(self._current_state)
+            s += "= %s" % str(self.state())
         return s
     
     def __repl__(self):
         return self.__str__()
 
+    def state(self):
+        """
+        return current state, derived from the axiom after skip
+
+        >>> l = D0Lsystem('F', {'F': 'F+F'})
+        >>> l.skip(2)
+        2
+        >>> l.state()
+        'F+F+F+F'
+        """
+        if self._current_state is None:
+            self._derive()
+            self._expansions.clear()
+        return self._current_state
+
+    def compact_state(self):
+        """
+        return current state, derived from the axiom after skip
+        """
+        return self.state()
+
+    def skip(self, count=1):
+        """
+        advance count generations without deriving the state: it is
+        derived when it is read, and finished is not updated
+
+        Returns:
+            the new generation
+        """
+        if self.finished or count < 1:
+            return self.generation
+        self.generation = self.generation + count
+        self._current_state = None
+        return self.generation
+
     def step(self, count=1):
         """
         calculate <count>  step of L-system
 
+        The current state is rewritten count times with the current
+        rules, its symbols rewritten 1, 2, 4, 8 ... times, without the
+        states of the generations between. When the state stops changing,
+        the lsystem is finished at the first generation equal to the
+        previous: the state of the generation before the last one is
+        derived to check it only if both have the same number of symbols,
+        counted without rewriting.
+
+        Each generation is recorded in stats, with its number of symbols
+        and a share of the time of the step like its symbols.
+
         Returns:
         	the new state
 
@@ -246,26 +469,215 @@ class D0Lsystem(BaseLsystem):
         >>> l = D0Lsystem('F', {'F': 'F[+F]F'})
         >>> l.step(2)
         'F[+F]F[+F[+F]F]F[+F]F'
+        >>> l = D0Lsystem('AB', {'A': 'C', 'C': ''})
+        >>> l.step(10), l.generation, l.finished
+        ('B', 3, True)
+
+        a rule changed in place applies from the current state
+
+        >>> l = D0Lsystem('F', {'F': 'FF'})
+        >>> l.step(2)
+        'FFFF'
+        >>> l.rules['F'] = 'F+F'
+        >>> l.step()
+        'F+FF+FF+FF+F'
         """
-        for i in xrange(count):
-            if self.finished:
-                return self._current_state
+        if self.finished or count < 1:
+            return self.state()
+        stats = self.stats
+        if stats is not None:
+            start = time.time()
+
+        self._sync_rules()
+        current = self.state()
+        first = self.generation
+        generation = first + count
+        lengths = self._lengths(current, count)
+        s = self._rewrite(current, count)
+        if lengths[-2] == lengths[-1] and (s == current if count == 1 else
+                s == self._rewrite(current, count - 1)):
+            # finished at a generation up to this one: step by step
+            s = current
+            while self.generation < generation and not self.finished:
+                os, s = s, self._rewrite(s, 1)
+                self.finished = os == s
+                self.generation = self.generation + 1
+        else:
+            self.generation = generation
+        self._current_state = s
+        self._expansions.clear()
+
+        if stats is not None:
+            seconds = time.time() - start
+            lengths = lengths[1:self.generation - first + 1]
+            total = float(sum(lengths)) or 1.0
+            for i, symbols in enumerate(lengths):
+                share = seconds * symbols / total
+                stats.add('rewrite', share)
+                stats.generation(first + i + 1, share, symbols)
 
+        return self._current_state
 
-            s = ""
-            os = self._current_state
-            for c in self._current_state:
-                if c in self.rules.keys():
-                    s = s + self.rules[c]
-                else:
-                    s = s + c
-            self._current_state = s
-            if os == s:
-                self.finished = True
-            self.generation = self.generation + 1
+    def _lengths(self, state, depth):
+        """
+        Returns:
+            list of the numbers of symbols of state rewritten 0, 1 ...
+            depth times, counted by symbol without rewriting
+
+        >>> D0Lsystem('F', {'F': 'F[+F]F', '+': ''})._lengths('F+', 2)
+        [2, 6, 20]
+        >>> D0Lsystem('Q', {1: 2})._lengths('Q', 2)
+        [1, 1, 1]
+        """
+        rules = self.rules
+        # symbols of state and of the rules of the symbols reached: the
+        # other rules, like the ones of a key which is not a symbol, are
+        # never used
+        reached = set(state)
+        todo = list(reached)
+        while todo:
+            c = todo.pop()
+            if c in rules:
+                new = set(rules[c]) - reached
+                reached.update(new)
+                todo.extend(new)
+        # number of each symbol in the rules
+        counts = dict((c, [(d, rules[c].count(d)) for d in set(rules[c])]) for c in reached if c in rules)
+        lengths = dict.fromkeys(reached, 1)
+        symbols = [(c, state.count(c)) for c in set(state)]
+        result = [len(state)]
+        for _ in xrange(depth):
+            lengths = dict((c, sum([lengths[d] * k for d, k in counts[c]]) if c in counts else 1)
+                    for c in lengths)
+            result.append(sum([lengths[c] * k for c, k in symbols]))
+        return result
+
+    def set_rule(self, symbol, rule):
+        """
+        change the rule of a symbol, or remove it with None, and derive
+        the current generation again
+
+        The expansions derived by the previous set_rule, since the last
+        step, are reused for the symbols which do not use the rule, so
+        editing the rule of a leaf again and again is cheap.
+
+        Returns:
+            the new state
 
+        >>> l = D0Lsystem('X', {'X': 'F[+X]F[-X]', 'F': 'FF'})
+        >>> l.step(2)
+        'FF[+F[+X]F[-X]]FF[-F[+X]F[-X]]'
+        >>> l.set_rule('X', 'F[-X]')
+        'FF[-F[-X]]'
+        >>> l.set_rule('F', None)
+        'F[-F[-X]]'
+        >>> l.step()
+        'F[-F[-F[-X]]]'
+        >>> l.set_rule('X', None)
+        Traceback (most recent call last):
+            ...
+        TypeError: rules must be a non empty dict
+        """
+        if not isinstance(symbol, str) or len(symbol) != 1:
+            raise TypeError('symbol must be a character')
+        if rule is None:
+            if self.rules.keys() == [symbol]:
+                raise TypeError('rules must be a non empty dict')
+            self.rules.pop(symbol, None)
+        else:
+            if not isinstance(rule, str):
+                raise TypeError('rule must be a string')
+            self.rules[symbol] = rule
+        self.finished = False
+        return self._derive()
+
+    def _derive(self):
+        """
+        derive the current generation again after a change of the rules
+
+        Returns:
+            the new state
+        """
+        stats = self.stats
+        if stats is not None:
+            start = time.time()
+
+        self._sync_rules()
+        self._current_state = self._derive_state(self.generation)
+
+        if stats is not None:
+            stats.add('rewrite', time.time() - start)
         return self._current_state
 
+    def _derive_state(self, generation):
+        """
+        Returns:
+            the axiom rewritten generation times
+        """
+        return self._rewrite(self.axiom, generation)
+
+    def _rewrite(self, state, depth):
+        """
+        Returns:
+            the symbols of state rewritten depth times
+        """
+        expansions = dict((c, self._expand(c, depth)) for c in set(state))
+        return ''.join(map(expansions.__getitem__, state))
+
+    def _expand(self, c, depth):
+        """
+        Returns:
+            the symbol c rewritten depth times
+
+        depth is split in first + power, with power the biggest power of
+        2 lower than depth: the short expansion of first is rewritten
+        with the long one of power, so only O(log(depth)) expansions of
+        each symbol are derived.
+
+        >>> l = D0Lsystem('X', {'X': 'F[+X]', 'F': 'FF'})
+        >>> l._expand('X', 2), l._expand('+', 2)
+        ('FF[+F[+X]]', '+')
+        >>> sorted(l._expansions)
+        [('F', 1), ('X', 1), ('X', 2)]
+        >>> l._expand('X', 3)
+        'FFFF[+FF[+F[+X]]]'
+        >>> s = l._expand('X', 6)
+        >>> sorted(k for k in l._expansions if k[0] == 'X')
+        [('X', 1), ('X', 2), ('X', 3), ('X', 4), ('X', 6)]
+        """
+        if depth == 0 or c not in self.rules:
+            return c
+        key = c, depth
+        try:
+            return self._expansions[key]
+        except KeyError:
+            pass
+        if depth == 1:
+            s = self.rules[c]
+        else:
+            power = 1 << (depth - 1).bit_length() - 1
+            s = self._rewrite(self._expand(c, depth - power), power)
+        self._expansions[key] = s
+        return s
+
+    def _sync_rules(self):
+        """
+        forget the expansions using the rules changed since the last call,
+        the rules may be changed in place
+
+        Returns:
+            the set of changed symbols
+        """
+        changed = _changed_rules(self._expansion_rules, self.rules)
+        if changed:
+            distances = _rule_distances(self._expansion_rules, changed)
+            for key in self._expansions.keys():
+                c, depth = key
+                if c in distances and distances[c] < depth:
+                    del self._expansions[key]
+            self._expansion_rules = dict(self.rules)
+        return changed
+
     def evolute(self, gen):
         """
         Generator of <gen> generation, return 'state' at each generation
@@ -301,7 +713,234 @@ class D0Lsystem(BaseLsystem):
             print "| %s -> %s" % (r, self.rules[r])
         for _ in xrange(n):
             self.step()
-            print 'gen ' + str(self.generation) + ': ' + self._current_state
+            print 'gen ' + str(self.generation) + ': ' + self.state()
+
+
+class RLED0Lsystem(D0Lsystem):
+    """
+    A D0Lsystem storing its state as runs (symbol, count)
+
+    step rewrites the runs without expanding them: with F -> FF, a run
+    of n `F` becomes a run of 2n `F`; and the interpreters draw a run of
+    n `F` as a single segment.
+
+    >>> l = RLED0Lsystem('X', {'X': 'F[+X]FX', 'F': 'FF'})
+    >>> l.step(2)
+    [('F', 2), ('[', 1), ('+', 1), ('F', 1), ('[', 1), ('+', 1), ('X', 1), (']', 1), ('F', 1), ('X', 1), (']', 1), ('F', 3), ('[', 1), ('+', 1), ('X', 1), (']', 1), ('F', 1), ('X', 1)]
+    >>> l.state() == D0Lsystem('X', {'X': 'F[+X]FX', 'F': 'FF'}).step(2)
+    True
+    >>> l = RLED0Lsystem('F', {'F': 'FF'})
+    >>> l.step(20)
+    [('F', 1048576)]
+    >>> RLED0Lsystem('AB', {'A': '', 'B': 'B'}).step(3)
+    [('B', 1)]
+    """
+    def __init__(self, axiom, rules, plot=None, stats=None):
+        """
+        Args: see D0Lsystem
+        """
+        D0Lsystem.__init__(self, axiom, rules, plot, stats)
+        self._runs = _runs(axiom)
+
+    def reset(self):
+        """
+        reset state to axiom
+        """
+        D0Lsystem.reset(self)
+        self._runs = _runs(self.axiom)
+
+    def state(self):
+        """
+        return current state as a string, expanded from the runs
+
+        >>> l = RLED0Lsystem('F', {'F': 'F+F'})
+        >>> l.step(2)
+        [('F', 1), ('+', 1), ('F', 1), ('+', 1), ('F', 1), ('+', 1), ('F', 1)]
+        >>> l.state()
+        'F+F+F+F'
+        """
+        if self._current_state is None:
+            self._current_state = ''.join([c * k for c, k in self._runs])
+        return self._current_state
+
+    def compact_state(self):
+        """
+        return current state as a list of runs (symbol, count)
+        """
+        return self._runs
+
+    def skip(self, count=1):
+        """
+        advance count generations: the runs are rewritten like by step
+
+        Returns:
+            the new generation
+        """
+        self.step(count)
+        return self.generation
+
+    def _derive(self):
+        """
+        derive the current generation again from the axiom: the runs are
+        not cached
+
+        >>> l = RLED0Lsystem('X', {'X': 'FX', 'F': 'FF'})
+        >>> l.step(3)
+        [('F', 7), ('X', 1)]
+        >>> l.set_rule('F', 'F')
+        [('F', 3), ('X', 1)]
+        """
+        generation = self.generation
+        self.reset()
+        return self.step(generation)
+
+    def step(self, count=1):
+        """
+        calculate <count> step of L-system on runs
+
+        Returns:
+        	the new state as a list of runs (symbol, count)
+        """
+        stats = self.stats
+        for i in xrange(count):
+            if self.finished:
+                return self._runs
+
+            if stats is not None:
+                start = time.time()
+
+            # rules as (first run, next runs); two consecutive runs of a
+            # rule have different symbols, so only the first run of a copy
+            # may merge with the previous run
+            rules = {}
+            for c, r in self.rules.items():
+                r = _runs(r)
+                if r:
+                    rules[c] = r[0][0], r[0][1], r[1:]
+                else:
+                    rules[c] = None
+
+            runs = [(None, 0)]
+            append = runs.append
+            extend = runs.extend
+            for c, k in self._runs:
+                rule = rules.get(c, c)
+                if rule is c:
+                    # no rule: the run is unchanged
+                    if runs[-1][0] == c:
+                        runs[-1] = c, runs[-1][1] + k
+                    else:
+                        append((c, k))
+                    continue
+                if rule is None:
+                    continue
+                d, m, middle = rule
+                if not middle:
+                    # a run stays a run
+                    if runs[-1][0] == d:
+                        runs[-1] = d, runs[-1][1] + m * k
+                    else:
+                        append((d, m * k))
+                    continue
+                for _ in xrange(k):
+                    if runs[-1][0] == d:
+                        runs[-1] = d, runs[-1][1] + m
+                    else:
+                        append((d, m))
+                    extend(middle)
+            del runs[0]
+
+            if runs == self._runs:
+                self.finished = True
+            self._runs = runs
+            self._current_state = None
+            self.generation = self.generation + 1
+
+            if stats is not None:
+                seconds = time.time() - start
+                stats.add('rewrite', seconds)
+                stats.generation(self.generation, seconds, sum([k for c, k in runs]))
+
+        return self._runs
+
+class _State(BaseLsystem):
+    """
+    Lsystem of a fixed state, a string or a list of runs, to draw any
+    state with a plot
+    """
+    def __init__(self, state):
+        self.axiom = state
+        self.rules = {}
+        self._plot = None
+        self.stats = None
+        self._current_state = state
+        self.generation = 0
+
+    def state(self):
+        """
+        return current state as a string
+
+        >>> _State([('F', 2), ('+', 1)]).state()
+        'FF+'
+        """
+        if isinstance(self._current_state, basestring):
+            return self._current_state
+        return ''.join([c * k for c, k in self._current_state])
+
+def _changed_rules(old, new):
+    """
+    Returns:
+        the set of the symbols with a different rule in old and new
+
+    >>> sorted(_changed_rules({'F': 'FF', 'X': 'F'}, {'F': 'F', 'X': 'F', 'Y': 'X'}))
+    ['F', 'Y']
+    """
+    return set([c for c in set(old) | set(new) if old.get(c) != new.get(c)])
+
+def _rule_distances(rules, symbols):
+    """
+    number of rewritings for one of the symbols to appear from each symbol
+
+    A symbol c rewritten depth times uses the rules of the symbols only
+    if distances[c] < depth.
+
+    Returns:
+        dict symbol -> distance, for the symbols reaching the symbols
+
+    >>> sorted(_rule_distances({'X': 'F[+X]', 'F': 'FF', 'A': 'X', 'B': 'C'}, ['F']).items())
+    [('A', 2), ('F', 0), ('X', 1)]
+    """
+    # symbols with a rule using each symbol
+    users = {}
+    for c, rule in rules.items():
+        for d in set(rule):
+            users.setdefault(d, []).append(c)
+    distances = dict((c, 0) for c in symbols)
+    level = list(symbols)
+    while level:
+        next_level = []
+        for d in level:
+            for c in users.get(d, ()):
+                if c not in distances:
+                    distances[c] = distances[d] + 1
+                    next_level.append(c)
+        level = next_level
+    return distances
+
+def _round9(f):
+    """
+    f rounded to 9 decimals like numpy.round, to remove the rounding
+    errors of the sums of moves before floor or ceil
+
+    >>> _round9(-1e-12), _round9(0.5e-9), _round9(1.5e-9)
+    (0.0, 0.0, 2e-09)
+    """
+    y = f * 1e9
+    r = math.floor(y + 0.5)
+    if r - y == 0.5 and r % 2:
+        # half to even
+        r -= 1
+    return r / 1e9
 
 def _bounding_box_int(xmin, xmax, ymin, ymax):
     """
@@ -317,25 +956,202 @@ def _bounding_box_int(xmin, xmax, ymin, ymax):
     ValueError
     >>> _bounding_box_int(-0.1, 0.1, 0.0, 0.1)
     (-1, 1, 0, 1)
+    >>> _bounding_box_int(-1e-12, 2 + 1e-12, 0.0, 0.0)
+    (0, 2, 0, 0)
     """
     def m(f):
-        return int(math.floor(f))
+        return int(math.floor(_round9(f)))
     def M(f):
-        return int(math.ceil(f))
+        return int(math.ceil(_round9(f)))
 
     if xmin > xmax or ymin > ymax:
         raise ValueError
 
     return m(xmin), M(xmax), m(ymin), M(ymax)
 
-def _bounding_box(state, length=10, angle=90):
+# angles equal, up to _ANGLE_TOLERANCE, to a fraction with a denominator
+# up to _ANGLE_GRID have a table of directions: 25.7 is 257/10 and gives
+# 3600 directions; the other angles use _Turns
+_ANGLE_GRID = 100
+_ANGLE_TOLERANCE = 1e-9
+
+# headings of the angles without table: a number of turns modulo _TURNS
+_TURNS = 1 << 62
+
+# largest table of directions computed at once, the bigger ones are
+# _Turns computed on first use: 25.73 gives 36000 directions
+_TABLE_SIZE = 3600
+
+# cache of _directions by angle, the last used at the end
+_directions_cache = collections.OrderedDict()
+_DIRECTIONS_CACHE_SIZE = 32
+
+def _gcd(a, b):
+    """
+    >>> _gcd(257, 3600), _gcd(-60, 360)
+    (1, 60)
+    """
+    a, b = abs(a), abs(b)
+    while b:
+        a, b = b, a % b
+    return a
+
+def _snap(f):
+    """
+    remove the rounding error of sin and cos around 0, 1/2 and 1
+
+    >>> _snap(math.cos(math.radians(90))), _snap(math.cos(math.radians(60)))
+    (0.0, 0.5)
+    """
+    for v in (0.0, 0.5, -0.5, 1.0, -1.0):
+        if abs(f - v) < 1e-12:
+            return v
+    return f
+
+def _angle_fraction(angle):
+    """
+    Returns:
+        the Fraction equal to angle with a denominator up to _ANGLE_GRID,
+        None if there is none
+
+    >>> _angle_fraction(25.7), _angle_fraction(0.004), _angle_fraction(137.50776)
+    (Fraction(257, 10), None, None)
+    """
+    import fractions
+
+    a = fractions.Fraction(angle).limit_denominator(_ANGLE_GRID)
+    if abs(float(a) - angle) > _ANGLE_TOLERANCE:
+        return None
+    return a
+
+class _Turns(dict):
+    """
+    cos or sin of the headings of a table of directions, computed on
+    first use: the heading i is i turns of angle from north, i modulo n,
+    so the interpreters work with it like with a list
+
+    With n = _TURNS, for the angles without table, the headings are
+    numbers of turns; otherwise angle is 360 / n, like the table.
+
+    >>> cos = _Turns(137.50776, math.cos)
+    >>> len(cos) == _TURNS, round(cos[1], 6), round(cos[_TURNS - 1], 6)
+    (True, -0.67549, 0.67549)
+    >>> _Turns(90.0, math.cos, n=4)[1], len(_Turns(0.01, math.sin, n=36000))
+    (-1.0, 36000)
+    """
+    def __init__(self, angle, function, factor=1.0, n=_TURNS):
+        dict.__init__(self)
+        self.angle = angle
+        self.function = function
+        self.factor = factor
+        self.n = n
+
+    def __missing__(self, i):
+        value = _snap(self.function(math.radians(90 + self.degrees(i)))) * self.factor
+        self[i] = value
+        return value
+
+    def __len__(self):
+        return self.n
+
+    def degrees(self, i):
+        """
+        Returns:
+            the rotation of the heading i from north, in degrees
+        """
+        if self.n == _TURNS and i >= _TURNS // 2:
+            i -= _TURNS
+        return math.fmod(i * self.angle, 360)
+
+def _scaled(table, factor):
+    """
+    Returns:
+        the values of a table of _directions multiplied by factor
+    """
+    if isinstance(table, _Turns):
+        return _Turns(table.angle, table.function, table.factor * factor, table.n)
+    return [v * factor for v in table]
+
+def _rotation(table, head):
+    """
+    Returns:
+        the rotation from north in degrees of the heading head of a table
+        of _directions
+    """
+    if isinstance(table, _Turns):
+        return table.degrees(head)
+    return head * 360.0 / len(table)
+
+def _directions(angle):
+    """
+    Table of the directions reachable from north with rotations of angle
+
+    The heading is an integer index modulo the number of directions
+    instead of an accumulated float angle: there is no drift, and the
+    geometry does not depend on the length of the state.
+
+    An angle which is not a fraction with a denominator up to
+    _ANGLE_GRID has no table: the heading is the number of turns, and
+    cos and sin are _Turns. The tables of more than _TABLE_SIZE
+    directions are _Turns too, and the last _DIRECTIONS_CACHE_SIZE
+    angles are cached.
+
+    Returns:
+        (turn, cos, sin)
+        turn: index increment of a left turn `-`
+        cos, sin: lists of the unit vector of each index, 0 is north
+
+    >>> _directions(90)
+    (1, [0.0, -1.0, 0.0, 1.0], [1.0, 0.0, -1.0, 0.0])
+    >>> turn, cos, sin = _directions(60)
+    >>> turn, round(cos[1], 6), sin[5]
+    (1, -0.866025, 0.5)
+    >>> turn, cos, sin = _directions(25.7)
+    >>> turn, len(cos)
+    (257, 3600)
+    >>> turn, cos, sin = _directions(0.004)
+    >>> turn, round(cos[1000], 6)
+    (1, -0.069756)
+    >>> turn, cos, sin = _directions(25.73)
+    >>> turn, len(cos), round(cos[turn], 6), len(cos.keys())
+    (2573, 36000, -0.434131, 1)
+    """
+    try:
+        directions = _directions_cache.pop(angle)
+    except KeyError:
+        directions = _directions_table(angle)
+    _directions_cache[angle] = directions
+    while len(_directions_cache) > _DIRECTIONS_CACHE_SIZE:
+        _directions_cache.popitem(last=False)
+    return directions
+
+def _directions_table(angle):
+    """
+    Returns:
+        _directions(angle), without cache
+    """
+    a = _angle_fraction(angle)
+    if a is None:
+        return 1, _Turns(angle, math.cos), _Turns(angle, math.sin)
+    # number of directions: 360 / gcd(a, 360)
+    n = 360 * a.denominator // _gcd(a.numerator, 360 * a.denominator)
+    turn = a.numerator * n // (360 * a.denominator)
+    unit = 360.0 / n
+    if n > _TABLE_SIZE:
+        return turn, _Turns(unit, math.cos, n=n), _Turns(unit, math.sin, n=n)
+    cos = [_snap(math.cos(math.radians(90 + i * unit))) for i in xrange(n)]
+    sin = [_snap(math.sin(math.radians(90 + i * unit))) for i in xrange(n)]
+    return turn, cos, sin
+
+def _bounding_box(state, length=10, angle=90, stats=None):
     """
     just calculate de boxing of a D0L string with branch
 
     Args:
-        state: string for current state
+        state: string for current state, or list of runs (symbol, count)
         length: length of a line
         angle: rotation angle in degree; + for right turn and - for left turn
+        stats: Stats instance recording the 'bbox' phase
 
     Return:
         (int xmin, int xmax, int ymin, int ymax)
@@ -350,7 +1166,75 @@ def _bounding_box(state, length=10, angle=90):
     (0, 10, 0, 10)
     >>> _bounding_box('F[+F]F')
     (0, 10, 0, 20)
+    >>> _bounding_box([('F', 1), ('[', 1), ('+', 1), ('F', 1), (']', 1), ('F', 1)])
+    (0, 10, 0, 20)
+    >>> _bounding_box([('F', 3), ('-', 2), ('F', 1)])
+    (0, 0, 0, 30)
+    >>> _bounding_box('F' + '+F' * 1000, 10, 0.004)
+    (0, 350, 0, 10002)
+
+    """
+    if stats is not None:
+        start = time.time()
+
+    box = _bounding_box_float(state, length, angle)
+
+    if stats is not None:
+        stats.add('bbox', time.time() - start)
+    return _bounding_box_int(*box)
+
+def _bounding_box_float(state, length, angle, cancel=None):
+    """
+    float bounding box of a string or of runs
+
+    Args:
+        cancel: threading.Event, the walk raises _Cancelled soon after it
+            is set
+
+    >>> import threading
+    >>> cancel = threading.Event()
+    >>> _bounding_box_float('F+F', 10, 90, cancel)
+    (0, 10.0, 0, 10.0)
+    >>> cancel.set()
+    >>> _bounding_box_float('F+F', 10, 90, cancel)
+    Traceback (most recent call last):
+        ...
+    _Cancelled
+    """
+    if isinstance(state, basestring):
+        walk = _bounding_box_string
+    else:
+        walk = _bounding_box_runs
+    if cancel is not None:
+        state = _cancellable(state, cancel)
+    return walk(state, length, angle)
+
+class _Cancelled(Exception):
+    """
+    raised by the walks of a state when their cancel event is set
+    """
+    pass
 
+def _cancellable(state, cancel, size=1 << 16):
+    """
+    iterator of the items of state, a string or a list, raising
+    _Cancelled every size items once cancel is set
+    """
+    import itertools
+
+    def chunks():
+        for i in xrange(0, len(state), size):
+            if cancel.is_set():
+                raise _Cancelled
+            yield state[i:i + size]
+        # a cancel during the last chunk
+        if cancel.is_set():
+            raise _Cancelled
+    return itertools.chain.from_iterable(chunks())
+
+def _bounding_box_string(state, length, angle):
+    """
+    float bounding box of a string, a run of `F` is a single move
     """
     xmin = 0
     xmax = 0
@@ -360,57 +1244,1220 @@ def _bounding_box(state, length=10, angle=90):
     y = 0
 
 
-    # like in turtle.mode('logo')
-    head = 90
+    # like in turtle.mode('logo'): index 0 is north
+    head = 0
     flength = float(length)
+    turn, cos, sin = _directions(angle)
+    n = len(cos)
+    dx = _scaled(cos, flength)
+    dy = _scaled(sin, flength)
 
     stack = []
 
+    # number of pending `F`
+    k = 0
 
     for c in state:
         if c == 'F':
-            if angle == 90:
-                if head % 360 == 0:
-                    x += flength
-                    xmax = max(xmax, x)
-                if head % 360 == 90:
-                    y += flength
-                    ymax = max(ymax, y)
-                if head % 360 == 180:
-                    x -= flength
-                    xmin = min(xmin, x)
-                if head % 360 == 270:
-                    y -= flength
-                    ymin = min(ymin, y)
-            else:
-                angle_rad = math.radians(head)
-                x = x + math.cos(angle_rad) * flength
-                y = y + math.sin(angle_rad) * flength
-                xmin = min(xmin, x)
-                xmax = max(xmax, x)
-                ymin = min(ymin, y)
-                ymax = max(ymax, y)
+            k += 1
+            continue
+        if k:
+            x += dx[head] * k
+            y += dy[head] * k
+            xmin = min(xmin, x)
+            xmax = max(xmax, x)
+            ymin = min(ymin, y)
+            ymax = max(ymax, y)
+            k = 0
         if c == '+':
-            head = (head - angle + 360) % 360
+            head = (head - turn) % n
         if c == '-':
-            head = (head + angle) % 360
+            head = (head + turn) % n
         if c == '[':
             stack.append( (x, y, head) )
         if c == ']':
             if len(stack) == 0:
                 raise ValueError('inconsistant state: using to much `]`')
             x, y, head = stack.pop()
+    if k:
+        x += dx[head] * k
+        y += dy[head] * k
+        xmin = min(xmin, x)
+        xmax = max(xmax, x)
+        ymin = min(ymin, y)
+        ymax = max(ymax, y)
     # print "stack=%s" % stack
-    return _bounding_box_int(xmin, xmax, ymin, ymax)
+    return xmin, xmax, ymin, ymax
+
+def _bounding_box_runs(runs, length, angle):
+    """
+    float bounding box of runs (symbol, count)
+    """
+    xmin = 0
+    xmax = 0
+    ymin = 0
+    ymax = 0 
+    x = 0
+    y = 0
 
+    # like in turtle.mode('logo'): index 0 is north
+    head = 0
+    flength = float(length)
+    turn, cos, sin = _directions(angle)
+    n = len(cos)
+    dx = _scaled(cos, flength)
+    dy = _scaled(sin, flength)
 
+    stack = []
 
-class Plot:
+    for c, k in runs:
+        if c == 'F':
+            x += dx[head] * k
+            y += dy[head] * k
+            xmin = min(xmin, x)
+            xmax = max(xmax, x)
+            ymin = min(ymin, y)
+            ymax = max(ymax, y)
+        if c == '+':
+            head = (head - turn * k) % n
+        if c == '-':
+            head = (head + turn * k) % n
+        if c == '[':
+            stack.extend([(x, y, head)] * k)
+        if c == ']':
+            if len(stack) < k:
+                raise ValueError('inconsistant state: using to much `]`')
+            if k > 1:
+                del stack[1 - k:]
+            x, y, head = stack.pop()
+    return xmin, xmax, ymin, ymax
+
+def _batches(iterable, size):
     """
-    Abstract Class for Lsystem ploting
+    Generator of lists of <size> items of iterable, the last one may be shorter
 
-    All public func must return self to chain the call
+    >>> list(_batches(xrange(5), 2))
+    [[0, 1], [2, 3], [4]]
     """
+    import itertools
+
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+def _segments(state, length=10, angle=90, x=0, y=0, stats=None, end=None):
+    """
+    Generator of the segments of a D0L string with branch
+
+    A run of `F` is a single segment.
+
+    Args:
+        state: string for current state, or list of runs (symbol, count)
+        length: length of a line
+        angle: rotation angle in degree; + for right turn and - for left turn
+        x, y: position of the root
+        stats: Stats instance counting symbols, segments and max_stack_depth
+        end: list receiving the final x, y and heading in degrees
+
+    Return:
+        (float x0, float y0, float x1, float y1) for each run of `F`
+
+    >>> list(_segments('F+F'))
+    [(0.0, 0.0, 0.0, 10.0), (0.0, 10.0, 10.0, 10.0)]
+    >>> list(_segments('F[-F]F', x=5))
+    [(5.0, 0.0, 5.0, 10.0), (5.0, 10.0, -5.0, 10.0), (5.0, 10.0, 5.0, 20.0)]
+    >>> list(_segments('FF[+F]'))
+    [(0.0, 0.0, 0.0, 20.0), (0.0, 20.0, 10.0, 20.0)]
+    >>> list(_segments([('F', 2), ('[', 1), ('+', 1), ('F', 1), (']', 1)]))
+    [(0.0, 0.0, 0.0, 20.0), (0.0, 20.0, 10.0, 20.0)]
+    >>> end = []
+    >>> list(_segments('F+F', end=end)) and end
+    [10.0, 10.0, 0.0]
+    >>> list(_segments('F]'))
+    Traceback (most recent call last):
+        ...
+    ValueError: inconsistant state: using to much `]`
+    """
+    if isinstance(state, basestring):
+        runs = _string_runs(state)
+    else:
+        runs = state
+
+    x = float(x)
+    y = float(y)
+
+    # like in turtle.mode('logo'): index 0 is north
+    head = 0
+    flength = float(length)
+    turn, cos, sin = _directions(angle)
+    n = len(cos)
+    dx = _scaled(cos, flength)
+    dy = _scaled(sin, flength)
+
+    stack = []
+    depth = 0
+    nb = 0
+    symbols = 0
+
+    for c, k in runs:
+        symbols += k
+        if c == 'F':
+            x1 = x + dx[head] * k
+            y1 = y + dy[head] * k
+            nb += 1
+            yield x, y, x1, y1
+            x, y = x1, y1
+        if c == '+':
+            head = (head - turn * k) % n
+        if c == '-':
+            head = (head + turn * k) % n
+        if c == '[':
+            stack.extend([(x, y, head)] * k)
+            if len(stack) > depth:
+                depth = len(stack)
+        if c == ']':
+            if len(stack) < k:
+                raise ValueError('inconsistant state: using to much `]`')
+            if k > 1:
+                del stack[1 - k:]
+            x, y, head = stack.pop()
+
+    if end is not None:
+        end[:] = x, y, (90 + _rotation(cos, head)) % 360
+    if stats is not None:
+        stats.count('symbols', symbols)
+        stats.count('segments', nb)
+        stats.maximum('max_stack_depth', depth)
+
+def _string_runs(state):
+    """
+    Generator of the runs (symbol, count) of a string for the
+    interpreters: runs of `F` are merged, other symbols have a count of 1
+
+    >>> list(_string_runs('FF+-F'))
+    [('F', 2), ('+', 1), ('-', 1), ('F', 1)]
+    """
+    k = 0
+    for c in state:
+        if c == 'F':
+            k += 1
+            continue
+        if k:
+            yield 'F', k
+            k = 0
+        yield c, 1
+    if k:
+        yield 'F', k
+
+def _runs(state):
+    """
+    run-length encoding of a string
+
+    Returns:
+        list of (symbol, count)
+
+    >>> _runs('FFF[+F]FF')
+    [('F', 3), ('[', 1), ('+', 1), ('F', 1), (']', 1), ('F', 2)]
+    >>> _runs('')
+    []
+    """
+    import itertools
+
+    return [(c, len(list(g))) for c, g in itertools.groupby(state)]
+
+def _symbols(state):
+    """
+    Returns:
+        number of symbols of a string or of a list of runs
+
+    >>> _symbols('F+F'), _symbols([('F', 3), ('+', 1)])
+    (3, 4)
+    """
+    if isinstance(state, basestring):
+        return len(state)
+    return sum([k for c, k in state])
+
+def _depth_symbols(state):
+    """
+    number of symbols of a string or of a list of runs pruned at each
+    depth, see _prune
+
+    Returns:
+        list of max depth + 1 numbers of symbols
+
+    >>> _depth_symbols('F[+F[-F]][F]')
+    [1, 8, 12]
+    >>> _depth_symbols([('F', 1), ('[', 2), ('F', 1), (']', 2)])
+    [1, 3, 6]
+    """
+    if isinstance(state, basestring):
+        import numpy
+
+        codes = numpy.frombuffer(state, dtype=numpy.uint8)
+        closes = codes == ord(']')
+        branch = numpy.cumsum((codes == ord('[')).astype(numpy.int64) - closes) + closes
+        return numpy.cumsum(numpy.bincount(branch)).tolist() if len(codes) else [0]
+
+    counts = [0]
+    level = 0
+    for c, k in state:
+        if c == '[':
+            for i in xrange(level + 1, level + k + 1):
+                if i == len(counts):
+                    counts.append(0)
+                counts[i] += 1
+            level += k
+        elif c == ']':
+            for i in xrange(level - k + 1, level + 1):
+                counts[i] += 1
+            level -= k
+        else:
+            counts[level] += k
+    for i in xrange(1, len(counts)):
+        counts[i] += counts[i - 1]
+    return counts
+
+def _prune(state, depth):
+    """
+    state without its branches deeper than depth, in the same form
+
+    >>> _prune('F[+F[-F]F]F', 1)
+    'F[+FF]F'
+    >>> _prune('F[+F[-F]F]F', 0)
+    'FF'
+    >>> _prune([('F', 1), ('[', 2), ('F', 1), (']', 2), ('F', 1)], 1)
+    [('F', 1), ('[', 1), (']', 1), ('F', 1)]
+    >>> _prune([('F', 1), ('[', 2), ('F', 1), (']', 2), ('F', 1)], 0)
+    [('F', 2)]
+    """
+    if isinstance(state, basestring):
+        import numpy
+
+        codes = numpy.frombuffer(state, dtype=numpy.uint8)
+        closes = codes == ord(']')
+        # depth of the branch of each symbol, `[` and `]` are in theirs
+        branch = numpy.cumsum((codes == ord('[')).astype(numpy.int64) - closes) + closes
+        return codes[branch <= depth].tostring()
+
+    runs = [(None, 0)]
+    level = 0
+    for c, k in state:
+        if c == '[':
+            kept = max(0, min(k, depth - level))
+            level += k
+        elif c == ']':
+            level -= k
+            kept = max(0, min(k, depth - level))
+        else:
+            kept = k if level <= depth else 0
+        if not kept:
+            continue
+        if runs[-1][0] == c:
+            runs[-1] = c, runs[-1][1] + kept
+        else:
+            runs.append((c, kept))
+    del runs[0]
+    return runs
+
+class AngleSweep:
+    """
+    Segments and bounding boxes of a state for many angles
+
+    The heading of a run of `F` is its number of turns (`-` minus `+`
+    on its path) times the angle. The turns, the runs and the branches
+    of the state are computed once, then the geometry of a vector of
+    angles is computed at once with NumPy: the moves of all the angles
+    are summed along the state, and each `]` goes back with the sum of
+    the moves of its branch.
+
+    >>> state = 'F[+F]F[-F]F'
+    >>> sweep = AngleSweep(state)
+    >>> sweep.bounding_boxes([90, 25.7]).tolist()
+    [[-10, 10, 0, 30], [-5, 5, 0, 30]]
+    >>> _bounding_box(state, 10, 25.7)
+    (-5, 5, 0, 30)
+    >>> sweep.segments([90])[0].round(6).tolist()[:2]
+    [[0.0, 0.0, 0.0, 10.0], [0.0, 10.0, 10.0, 10.0]]
+    """
+    # number of (move, angle) values computed at once
+    cells = 1 << 20
+
+    def __init__(self, state, length=10, stats=None):
+        """
+        Args:
+            state: string for the state, or list of runs (symbol, count)
+            length: length of a line
+            stats: Stats instance recording the 'bbox' and
+                'interpretation' phases
+        """
+        import numpy
+
+        self.stats = stats
+        if stats is not None:
+            start = time.time()
+
+        if isinstance(state, basestring):
+            runs = _string_runs(state)
+        else:
+            runs = state
+
+        # for each run of `F`: turns, length and branch, and for each
+        # `]`: branch closed; the moves and the `]` are the events
+        turns = []
+        lengths = []
+        branches = []
+        moves = []
+        closes = []
+        closed = []
+        turn = 0
+        # branch 0 is the trunk, count is the number of branches
+        branch = 0
+        count = 0
+        stack = []
+        depth = 0
+        symbols = 0
+        events = 0
+        for c, k in runs:
+            symbols += k
+            if c == 'F':
+                turns.append(turn)
+                lengths.append(k)
+                branches.append(branch)
+                moves.append(events)
+                events += 1
+            if c == '+':
+                turn -= k
+            if c == '-':
+                turn += k
+            if c == '[':
+                for i in xrange(k):
+                    stack.append((turn, branch))
+                    count += 1
+                    branch = count
+                if len(stack) > depth:
+                    depth = len(stack)
+            if c == ']':
+                if len(stack) < k:
+                    raise ValueError('inconsistant state: using to much `]`')
+                for i in xrange(k):
+                    closes.append(events)
+                    closed.append(branch)
+                    events += 1
+                    turn, branch = stack.pop()
+
+        self.events = events
+        self.turns = numpy.array(turns, dtype=numpy.float64)
+        self.lengths = numpy.array(lengths, dtype=numpy.float64) * length
+        self.moves = numpy.array(moves, dtype=numpy.int64)
+        self.closes = numpy.array(closes, dtype=numpy.int64)
+        # moves sorted by branch, and index of the sum of the moves of
+        # the branch closed by each `]`, the last one is 0
+        branches = numpy.array(branches, dtype=numpy.int64)
+        self._by_branch = numpy.argsort(branches, kind='mergesort')
+        names, self._branch_starts = numpy.unique(branches[self._by_branch], return_index=True)
+        closed = numpy.array(closed, dtype=numpy.int64)
+        index = numpy.searchsorted(names, closed)
+        found = index < len(names)
+        found[found] = names[index[found]] == closed[found]
+        self._closed = numpy.where(found, index, len(names))
+
+        if stats is not None:
+            stats.add('interpretation', time.time() - start)
+            stats.count('symbols', symbols)
+            stats.count('segments', len(turns))
+            stats.maximum('max_stack_depth', depth)
+
+    def _chunks(self, angles):
+        """
+        Generator of (i, j, x0, y0, x1, y1) for the angles[i:j], with
+        arrays of shape (moves, j - i)
+        """
+        import numpy
+
+        # angles rounded like in _directions
+        angles = numpy.radians([float(_angle_fraction(a) or a)
+                for a in numpy.asarray(angles, dtype=numpy.float64).reshape(-1)])
+        size = max(1, self.cells // max(self.events, 1))
+        for i in xrange(0, len(angles), size):
+            a = angles[i:i + size]
+            # heading of index t is 90 + t * angle
+            theta = self.turns[:, None] * a[None, :]
+            dx = -numpy.sin(theta) * self.lengths[:, None]
+            dy = numpy.cos(theta) * self.lengths[:, None]
+            ends = []
+            for d in (dx, dy):
+                e = numpy.zeros((self.events, len(a)))
+                e[self.moves] = d
+                if len(self.closes):
+                    sums = numpy.zeros((len(self._branch_starts) + 1, len(a)))
+                    if len(d):
+                        sums[:-1] = numpy.add.reduceat(d[self._by_branch], self._branch_starts, axis=0)
+                    e[self.closes] = -sums[self._closed]
+                ends.append(numpy.cumsum(e, axis=0)[self.moves])
+            x1, y1 = ends
+            yield i, i + len(a), x1 - dx, y1 - dy, x1, y1
+
+    def bounding_boxes(self, angles):
+        """
+        bounding box of the state for each angle, like _bounding_box
+
+        Returns:
+            int array of shape (len(angles), 4): xmin, xmax, ymin, ymax
+        """
+        import numpy
+
+        stats = self.stats
+        if stats is not None:
+            start = time.time()
+
+        boxes = numpy.zeros((numpy.size(angles), 4))
+        for i, j, x0, y0, x1, y1 in self._chunks(angles):
+            if len(x1):
+                boxes[i:j, 0] = numpy.minimum(x1.min(axis=0), 0)
+                boxes[i:j, 1] = numpy.maximum(x1.max(axis=0), 0)
+                boxes[i:j, 2] = numpy.minimum(y1.min(axis=0), 0)
+                boxes[i:j, 3] = numpy.maximum(y1.max(axis=0), 0)
+        # remove the rounding errors of the sums before the rounding,
+        # like _round9 in _bounding_box_int
+        boxes = boxes.round(9)
+        boxes[:, 0::2] = numpy.floor(boxes[:, 0::2])
+        boxes[:, 1::2] = numpy.ceil(boxes[:, 1::2])
+
+        if stats is not None:
+            stats.add('bbox', time.time() - start)
+        return boxes.astype(numpy.int64)
+
+    def segments(self, angles, x=0, y=0):
+        """
+        segments of the state for each angle, like _segments
+
+        Returns:
+            float array of shape (len(angles), segments, 4): x0, y0,
+            x1, y1 of each run of `F`
+        """
+        import numpy
+
+        stats = self.stats
+        if stats is not None:
+            start = time.time()
+
+        segments = numpy.empty((numpy.size(angles), len(self.moves), 4))
+        for i, j, x0, y0, x1, y1 in self._chunks(angles):
+            for c, v in enumerate((x0, y0, x1, y1)):
+                segments[i:j, :, c] = v.T
+        segments[:, :, 0::2] += x
+        segments[:, :, 1::2] += y
+
+        if stats is not None:
+            stats.add('interpretation', time.time() - start)
+        return segments
+
+class Geometry:
+    """
+    Segments of a state in NumPy arrays sharing one buffer
+
+    Each run of `F` is a segment, in the order of the state:
+        coords: float64 array (n, 4) of x0, y0, x1, y1
+        index: int64 array (n,) index in the state of its first `F`
+        branch: int64 array (n,) index in the state of the `[` opening
+            its branch, -1 for the trunk
+        depth: int32 array (n,) depth of its branch
+
+    The arrays are contiguous views of self.buffer, a uint8 array, at
+    the offsets of self.layout: the buffer can be handed to other code or
+    processes (memoryview, shared memory, mmap) and seen again as arrays
+    with Geometry.view, without copy.
+
+    >>> g = _geometry('F[+F]F')
+    >>> g.coords.tolist()
+    [[0.0, 0.0, 0.0, 10.0], [0.0, 10.0, 10.0, 10.0], [0.0, 10.0, 0.0, 20.0]]
+    >>> g.index.tolist(), g.branch.tolist(), g.depth.tolist()
+    ([0, 3, 5], [-1, 1, -1], [0, 1, 0])
+    >>> import numpy
+    >>> numpy.may_share_memory(g.coords, g.buffer), numpy.may_share_memory(g.depth, g.buffer)
+    (True, True)
+    >>> h = Geometry.view(memoryview(g.buffer), len(g))
+    >>> h.index.tolist()
+    [0, 3, 5]
+    """
+    # name, dtype and number of values by segment of the arrays, in the
+    # order of the buffer: the biggest items first to align them
+    fields = [
+        ('coords', 'float64', 4),
+        ('index', 'int64', 1),
+        ('branch', 'int64', 1),
+        ('depth', 'int32', 1),
+    ]
+
+    def __init__(self, size, buffer=None):
+        """
+        Args:
+            size: number of segments
+            buffer: writable object of the buffer protocol (bytearray,
+                mmap, multiprocessing.RawArray, ...) of at least
+                Geometry.nbytes(size) bytes, None to allocate it
+        """
+        import numpy
+
+        nbytes = self.nbytes(size)
+        if buffer is None:
+            self.buffer = numpy.empty(nbytes, dtype=numpy.uint8)
+        elif isinstance(buffer, memoryview):
+            # numpy.frombuffer of python 2 only knows the old buffers
+            buffer = numpy.asarray(buffer).reshape(-1).view(numpy.uint8)
+            if len(buffer) < nbytes:
+                raise ValueError('buffer is smaller than requested size')
+            self.buffer = buffer[:nbytes]
+        else:
+            self.buffer = numpy.frombuffer(buffer, dtype=numpy.uint8, count=nbytes)
+        self.size = size
+        # name -> (offset in bytes, dtype, shape)
+        self.layout = {}
+        offset = 0
+        for name, dtype, count in self.fields:
+            dtype = numpy.dtype(dtype)
+            shape = (size, count) if count > 1 else (size,)
+            self.layout[name] = offset, dtype.str, shape
+            view = self.buffer[offset:offset + size * count * dtype.itemsize].view(dtype).reshape(shape)
+            setattr(self, name, view)
+            offset += size * count * dtype.itemsize
+
+    @classmethod
+    def nbytes(cls, size):
+        """
+        Returns:
+            the size in bytes of the buffer of size segments
+        """
+        import numpy
+
+        return size * sum([numpy.dtype(dtype).itemsize * count for name, dtype, count in cls.fields])
+
+    @classmethod
+    def view(cls, buffer, size):
+        """
+        Returns:
+            a Geometry of the size segments already in buffer
+        """
+        return cls(size, buffer)
+
+    def __len__(self):
+        return self.size
+
+def _branches(codes):
+    """
+    branches of the symbols of a state, with NumPy
+
+    Args:
+        codes: uint8 array of the symbols
+
+    Returns:
+        (depth, parent)
+        depth: int64 array of the depth of the branch of each symbol,
+            `[` and `]` are in the branch they open or close
+        parent: int64 array of the index of the `[` opening the branch
+            of each symbol, -1 for the trunk
+
+    >>> import numpy
+    >>> depth, parent = _branches(numpy.frombuffer('F[[F]][F]', dtype=numpy.uint8))
+    >>> depth.tolist(), parent.tolist()
+    ([0, 1, 2, 2, 2, 1, 1, 1, 1], [-1, 1, 2, 2, 2, 1, 6, 6, 6])
+    """
+    import numpy
+
+    opens = codes == ord('[')
+    closes = codes == ord(']')
+    after = numpy.cumsum(opens.astype(numpy.int64) - closes)
+    if len(after) and after.min() < 0:
+        raise ValueError('inconsistant state: using to much `]`')
+    depth = after + closes
+
+    # sorted by depth then position, the parent of a symbol is the last
+    # `[` before it: the first symbol of each depth is a `[`
+    index = numpy.arange(len(codes))
+    order = numpy.lexsort((index, depth))
+    opening = numpy.where(opens[order], index, -1)
+    parent = numpy.empty(len(codes), dtype=numpy.int64)
+    if len(codes):
+        parent[order] = order[numpy.maximum.accumulate(opening)]
+    parent[depth == 0] = -1
+    return depth, parent
+
+def _geometry(state, length=10, angle=90, x=0, y=0, buffer=None, stats=None, carry=None):
+    """
+    Geometry of a D0L string with branch, like _segments but with NumPy
+
+    The heading of each symbol is the sum of the turns before it, and
+    its position the sum of the moves before it, where each `]` goes
+    back by the sum of the turns and moves of its branch.
+
+    Args:
+        state: string for current state, or list of runs (symbol, count)
+        length: length of a line
+        angle: rotation angle in degree; + for right turn and - for left turn
+        x, y: position of the root
+        buffer: buffer of the Geometry, see Geometry
+        stats: Stats instance counting symbols, segments and max_stack_depth
+        carry: list of the sums of the turns, x and y moves before the
+            state, updated to the sums after it, see _geometries
+
+    Returns:
+        Geometry of the runs of `F`
+
+    >>> _geometry([('F', 2), ('[', 1), ('+', 1), ('F', 1), (']', 1)]).coords.tolist()
+    [[0.0, 0.0, 0.0, 20.0], [0.0, 20.0, 10.0, 20.0]]
+    >>> _geometry('F]')
+    Traceback (most recent call last):
+        ...
+    ValueError: inconsistant state: using to much `]`
+    """
+    import numpy
+
+    # symbols with the runs of `F` as one symbol: code, number of `F`
+    # and index in the state
+    if isinstance(state, basestring):
+        codes = numpy.frombuffer(state, dtype=numpy.uint8)
+        is_f = codes == ord('F')
+        run = is_f.copy()
+        run[1:] &= ~is_f[:-1]
+        keep = ~is_f | run
+        index = numpy.flatnonzero(keep)
+        ends = numpy.flatnonzero(is_f & ~numpy.append(is_f[1:], False))
+        count = numpy.ones(len(index), dtype=numpy.int64)
+        codes = codes[keep]
+        count[codes == ord('F')] = ends - numpy.flatnonzero(run) + 1
+        symbols = len(state)
+    else:
+        runs_codes = numpy.array([ord(c) for c, k in state], dtype=numpy.uint8)
+        runs_count = numpy.array([k for c, k in state], dtype=numpy.int64)
+        starts = numpy.cumsum(runs_count) - runs_count
+        # other runs than `F` are repeated
+        is_f = runs_codes == ord('F')
+        repeat = numpy.where(is_f, 1, runs_count)
+        codes = numpy.repeat(runs_codes, repeat)
+        count = numpy.where(numpy.repeat(is_f, repeat), numpy.repeat(runs_count, repeat), 1)
+        first = numpy.cumsum(repeat) - repeat
+        index = numpy.repeat(starts, repeat) + numpy.arange(len(codes)) - numpy.repeat(first, repeat)
+        symbols = int(runs_count.sum())
+
+    depth, parent = _branches(codes)
+    closes = numpy.flatnonzero(codes == ord(']'))
+    moves = numpy.flatnonzero(codes == ord('F'))
+
+    def sums(values, i):
+        # sum of the values of each symbol before it, each `]` going back
+        # by the sum of the values of its branch
+        branch = numpy.bincount(parent + 1, weights=values, minlength=len(codes) + 1)
+        values = values.copy()
+        values[closes] -= branch[parent[closes] + 1]
+        if carry is None or not len(values):
+            return numpy.cumsum(values)
+        # the sums go on from the ones of the previous part
+        values[0] += carry[i]
+        values = numpy.cumsum(values)
+        carry[i] = values[-1]
+        return values
+
+    # heading: index of _directions, 0 is north
+    turn, cos, sin = _directions(angle)
+    n = len(cos)
+    turns = numpy.zeros(len(codes))
+    turns[codes == ord('+')] = -turn
+    turns[codes == ord('-')] = turn
+    heads = sums(turns, 0).astype(numpy.int64)[moves]
+    if isinstance(cos, _Turns) and n == _TURNS:
+        theta = numpy.radians(90 + numpy.fmod(heads * float(angle), 360))
+        cos, sin = numpy.cos(theta), numpy.sin(theta)
+    elif isinstance(cos, _Turns):
+        # the values of the headings used only
+        heads, inverse = numpy.unique(heads % n, return_inverse=True)
+        cos = numpy.array([cos[h] for h in heads.tolist()])[inverse]
+        sin = numpy.array([sin[h] for h in heads.tolist()])[inverse]
+    else:
+        heads %= n
+        cos, sin = numpy.array(cos)[heads], numpy.array(sin)[heads]
+
+    geometry = Geometry(len(moves), buffer)
+    dx = numpy.zeros(len(codes))
+    dy = numpy.zeros(len(codes))
+    flength = float(length)
+    dx[moves] = cos * flength * count[moves]
+    dy[moves] = sin * flength * count[moves]
+    coords = geometry.coords
+    coords[:, 2] = sums(dx, 1)[moves] + x
+    coords[:, 3] = sums(dy, 2)[moves] + y
+    coords[:, 0] = coords[:, 2] - dx[moves]
+    coords[:, 1] = coords[:, 3] - dy[moves]
+    geometry.index[:] = index[moves]
+    branch = parent[moves]
+    geometry.branch[:] = numpy.where(branch < 0, -1, index[branch])
+    geometry.depth[:] = depth[moves]
+
+    if stats is not None:
+        stats.count('symbols', symbols)
+        stats.count('segments', len(moves))
+        stats.maximum('max_stack_depth', int(depth.max()) if len(depth) else 0)
+    return geometry
+
+def _parts(state, size):
+    """
+    Generator of (offset, part) of a state, string or list of runs, cut
+    in parts of about size items between the branches of the trunk and
+    not in a run of `F`; offset is the number of symbols before the part
+
+    >>> list(_parts('F[+F]F[-F]FF', 3))
+    [(0, 'F'), (1, '[+F]F'), (6, '[-F]FF')]
+    >>> list(_parts([('F', 2), ('[', 2), (']', 2), ('F', 1)], 1))
+    [(0, [('F', 2)]), (2, [('[', 2), (']', 2), ('F', 1)])]
+    """
+    import numpy
+
+    string = isinstance(state, basestring)
+    start = 0
+    offset = 0
+    while start < len(state):
+        stop = start + size
+        while stop < len(state):
+            # depth after each item of the window, and cuts before the
+            # items after the trunk
+            if string:
+                codes = numpy.frombuffer(state, dtype=numpy.uint8, count=stop - start, offset=start)
+                depth = numpy.cumsum((codes == ord('[')).astype(numpy.int64) - (codes == ord(']')))
+                is_f = codes == ord('F')
+                cuts = numpy.flatnonzero((depth[:-1] == 0) & ~(is_f[:-1] & is_f[1:]))
+            else:
+                depth = numpy.cumsum([k if c == '[' else -k if c == ']' else 0
+                        for c, k in state[start:stop]])
+                cuts = numpy.flatnonzero(depth[:-1] == 0)
+            if len(cuts):
+                stop = start + int(cuts[-1]) + 1
+                break
+            # a branch longer than the window
+            stop = start + 2 * (stop - start)
+        part = state[start:stop]
+        yield offset, part
+        offset += len(part) if string else sum([k for c, k in part])
+        start = stop
+
+def _geometries(state, length=10, angle=90, size=1 << 16, stats=None):
+    """
+    Generator of the Geometry of the parts of a state of about size
+    symbols, see _parts: with the sums carried from part to part, the
+    coords are the ones of _geometry(state), without holding them all
+
+    >>> g = _geometry('F[+F]F[-F]F', 10, 25.7)
+    >>> parts = list(_geometries('F[+F]F[-F]F', 10, 25.7, 2))
+    >>> len(parts), sum([p.coords.tolist() for p in parts], []) == g.coords.tolist()
+    (3, True)
+    >>> sum([p.index.tolist() for p in parts], []) == g.index.tolist()
+    True
+    >>> sum([p.branch.tolist() for p in parts], []) == g.branch.tolist()
+    True
+    """
+    carry = [0.0, 0.0, 0.0]
+    for offset, part in _parts(state, size):
+        geometry = _geometry(part, length, angle, stats=stats, carry=carry)
+        geometry.index += offset
+        geometry.branch[geometry.branch >= 0] += offset
+        yield geometry
+
+class SegmentIndex:
+    """
+    Uniform grid over the segments of a Geometry, for picking and region
+    queries
+
+    The cells are about the size of a segment, and each segment is in
+    the cells crossed by its bounding box. The segments of the cells are
+    stored in CSR: the segments of the cell c are
+    self.items[self.starts[c]:self.starts[c + 1]], and the cells of a
+    row are consecutive, so a query gathers one slice by row.
+
+    Queries return segment numbers of the Geometry, whose index and
+    branch give the symbols in the state.
+
+    >>> g = _geometry('F[+F]F[-F]F')
+    >>> grid = SegmentIndex(g)
+    >>> i = grid.point(6, 11, 2)
+    >>> i, g.index[i], g.branch[i]
+    (1, 3, 1)
+    >>> grid.point(6, 15, 2) is None
+    True
+    >>> grid.rect(-1, 1, 5, 25).tolist()
+    [0, 1, 2, 3, 4]
+    >>> grid.rect(-1, 1, 5, 25, inside=True).tolist()
+    [2]
+    """
+
+    def __init__(self, geometry, cell=None):
+        """
+        Args:
+            geometry: Geometry of the segments
+            cell: size of the cells, None for about the size of a
+                segment, at least the side of the box by segment
+        """
+        import numpy
+
+        self.geometry = geometry
+        coords = geometry.coords
+        n = len(coords)
+        if n:
+            self.xmin = float(coords[:, 0::2].min())
+            self.ymin = float(coords[:, 1::2].min())
+            width = float(coords[:, 0::2].max()) - self.xmin
+            height = float(coords[:, 1::2].max()) - self.ymin
+        else:
+            self.xmin = self.ymin = width = height = 0.0
+        if cell is None:
+            lengths = numpy.abs(coords[:, 2] - coords[:, 0]) + numpy.abs(coords[:, 3] - coords[:, 1])
+            cell = max(math.sqrt(width * height / max(n, 1)), float(lengths.mean()) if n else 0)
+        self.cell = float(cell) or 1.0
+        self.nx = int(width / self.cell) + 1
+        self.ny = int(height / self.cell) + 1
+
+        # cells of the bounding box of each segment
+        x0, x1 = self._columns(numpy.minimum(coords[:, 0], coords[:, 2]),
+                numpy.maximum(coords[:, 0], coords[:, 2]))
+        y0, y1 = self._rows(numpy.minimum(coords[:, 1], coords[:, 3]),
+                numpy.maximum(coords[:, 1], coords[:, 3]))
+        columns = x1 - x0 + 1
+        counts = columns * (y1 - y0 + 1)
+        segments = numpy.repeat(numpy.arange(n), counts)
+        # rank of each item in the cells of its segment
+        rank = numpy.arange(len(segments)) - numpy.repeat(numpy.cumsum(counts) - counts, counts)
+        columns = numpy.repeat(columns, counts)
+        cells = ((numpy.repeat(y0, counts) + rank // columns) * self.nx +
+                numpy.repeat(x0, counts) + rank % columns)
+
+        order = numpy.argsort(cells, kind='mergesort')
+        self.items = segments[order]
+        self.starts = numpy.zeros(self.nx * self.ny + 1, dtype=numpy.int64)
+        numpy.cumsum(numpy.bincount(cells, minlength=self.nx * self.ny), out=self.starts[1:])
+
+    def _columns(self, xmin, xmax):
+        """
+        Returns:
+            (first, last) columns of cells of the intervals [xmin, xmax]
+        """
+        import numpy
+
+        first = numpy.floor((xmin - self.xmin) / self.cell).astype(numpy.int64)
+        last = numpy.floor((xmax - self.xmin) / self.cell).astype(numpy.int64)
+        return numpy.clip(first, 0, self.nx - 1), numpy.clip(last, 0, self.nx - 1)
+
+    def _rows(self, ymin, ymax):
+        """
+        Returns:
+            (first, last) rows of cells of the intervals [ymin, ymax]
+        """
+        import numpy
+
+        first = numpy.floor((ymin - self.ymin) / self.cell).astype(numpy.int64)
+        last = numpy.floor((ymax - self.ymin) / self.cell).astype(numpy.int64)
+        return numpy.clip(first, 0, self.ny - 1), numpy.clip(last, 0, self.ny - 1)
+
+    def _candidates(self, xmin, xmax, ymin, ymax):
+        """
+        Returns:
+            sorted array of the segments in the cells of a box
+        """
+        import numpy
+
+        x0, x1 = self._columns(numpy.array(xmin), numpy.array(xmax))
+        y0, y1 = self._rows(numpy.array(ymin), numpy.array(ymax))
+        rows = numpy.arange(y0, y1 + 1) * self.nx
+        low = self.starts[rows + x0]
+        high = self.starts[rows + x1 + 1]
+        counts = high - low
+        items = numpy.arange(counts.sum()) + numpy.repeat(low - (numpy.cumsum(counts) - counts), counts)
+        return numpy.unique(self.items[items])
+
+    def point(self, x, y, tolerance=0):
+        """
+        Returns:
+            the number of the segment nearest to x, y at a distance up to
+            tolerance, None if there is none
+        """
+        import numpy
+
+        if not len(self.items):
+            return None
+        candidates = self._candidates(x - tolerance, x + tolerance, y - tolerance, y + tolerance)
+        coords = self.geometry.coords[candidates]
+        dx = coords[:, 2] - coords[:, 0]
+        dy = coords[:, 3] - coords[:, 1]
+        norm = dx * dx + dy * dy
+        norm[norm == 0] = 1
+        t = numpy.clip(((x - coords[:, 0]) * dx + (y - coords[:, 1]) * dy) / norm, 0, 1)
+        ex = coords[:, 0] + t * dx - x
+        ey = coords[:, 1] + t * dy - y
+        distances = ex * ex + ey * ey
+        if not len(distances):
+            return None
+        nearest = distances.argmin()
+        if distances[nearest] > tolerance * tolerance:
+            return None
+        return int(candidates[nearest])
+
+    def rect(self, xmin, xmax, ymin, ymax, inside=False):
+        """
+        Args:
+            inside: only the segments inside the rectangle, otherwise
+                the segments crossing it too
+
+        Returns:
+            sorted int array of the numbers of the segments in the
+            rectangle
+        """
+        import numpy
+
+        if not len(self.items):
+            return numpy.zeros(0, dtype=numpy.int64)
+        candidates = self._candidates(xmin, xmax, ymin, ymax)
+        coords = self.geometry.coords[candidates]
+        x0, y0, x1, y1 = coords[:, 0], coords[:, 1], coords[:, 2], coords[:, 3]
+        if inside:
+            keep = ((numpy.minimum(x0, x1) >= xmin) & (numpy.maximum(x0, x1) <= xmax) &
+                    (numpy.minimum(y0, y1) >= ymin) & (numpy.maximum(y0, y1) <= ymax))
+            return candidates[keep]
+
+        # Liang-Barsky: the part of the segment in each slab of the
+        # rectangle is [t0, t1] of x0 + t * dx
+        t0 = numpy.zeros(len(coords))
+        t1 = numpy.ones(len(coords))
+        keep = numpy.ones(len(coords), dtype=bool)
+        for p, q in ((x0 - x1, x0 - xmin), (x1 - x0, xmax - x0),
+                (y0 - y1, y0 - ymin), (y1 - y0, ymax - y0)):
+            parallel = p == 0
+            keep &= ~parallel | (q >= 0)
+            with numpy.errstate(divide='ignore', invalid='ignore'):
+                t = q / p
+            t0 = numpy.where(p < 0, numpy.maximum(t0, t), t0)
+            t1 = numpy.where(p > 0, numpy.minimum(t1, t), t1)
+        return candidates[keep & (t0 <= t1)]
+
+def _convex_hull(points):
+    """
+    convex hull of points, counterclockwise from the lowest x
+    (Andrew's monotone chain); points are rounded to 1e-9
+
+    >>> _convex_hull([(0, 0), (1, 1), (2, 0), (1, 0), (1, -1), (2, 0)])
+    [(0.0, 0.0), (1.0, -1.0), (2.0, 0.0), (1.0, 1.0)]
+    >>> _convex_hull([])
+    []
+    """
+    points = sorted(set([(round(x, 9), round(y, 9)) for x, y in points]))
+    if len(points) <= 2:
+        return points
+
+    def cross(o, a, b):
+        return (a[0] - o[0]) * (b[1] - o[1]) - (a[1] - o[1]) * (b[0] - o[0])
+
+    lower = []
+    for p in points:
+        while len(lower) >= 2 and cross(lower[-2], lower[-1], p) <= 0:
+            lower.pop()
+        lower.append(p)
+    upper = []
+    for p in reversed(points):
+        while len(upper) >= 2 and cross(upper[-2], upper[-1], p) <= 0:
+            upper.pop()
+        upper.append(p)
+    return lower[:-1] + upper[:-1]
+
+class _Instances:
+    """
+    SVG definitions of the shapes of a D0Lsystem
+
+    In a D0Lsystem, a symbol expanded <depth> times always draws the same
+    shape, up to a rotation and a translation. Each shape (symbol, depth)
+    drawing something is defined once in its own frame -- root at 0, 0
+    and heading north -- and placed by <use> transforms, so the size of
+    the document grows with the generations, not with the segments.
+
+    A shape is (id, ex, ey, eh, hull):
+        id: id of its definition, None for the symbols of depth 0
+        ex, ey, eh: position and heading index of the turtle at its end
+        hull: convex hull of its lines, [] if it draws nothing
+
+    >>> i = _Instances({'F': 'F[+F]F'})
+    >>> content, ex, ey, eh, hull = i.body('F', 2)
+    >>> print content
+    <use xlink:href="#s70_2"/>
+    >>> for d in i.defs.values(): print d
+    <g id="s70_1"><path d="M0 0L0 10L10 10M0 10L0 20"/></g>
+    <g id="s70_2"><use xlink:href="#s70_1"/><use xlink:href="#s70_1" transform="translate(0 20) rotate(270)"/><use xlink:href="#s70_1" transform="translate(0 20)"/></g>
+    >>> ex, ey, eh
+    (0.0, 40.0, 0)
+    >>> hull
+    [(0.0, 0.0), (20.0, 20.0), (0.0, 40.0)]
+    """
+    def __init__(self, rules, length=10, angle=90, prefix='s'):
+        for c in '[]':
+            if c in rules:
+                raise ValueError('instances need rules without `%s`' % c)
+        self.rules = dict(rules)
+        self.length = float(length)
+        self.angle = angle
+        self.prefix = prefix
+        # number of updates, in the ids of the new shapes
+        self.version = 0
+        turn, cos, sin = _directions(angle)
+        self.turn = turn
+        self.n = len(cos)
+        self.cos = cos
+        # cos and sin of the rotation of index i, direction i is 90 + i * unit
+        self.rcos = sin
+        self.rsin = _scaled(cos, -1.0)
+        # (symbol, depth) -> shape
+        self.shapes = {}
+        # id -> svg definition, a definition is after the ones it uses
+        self.defs = collections.OrderedDict()
+
+    def shape(self, c, depth):
+        """
+        Returns:
+            the shape of the symbol c expanded depth times
+        """
+        key = c, depth
+        try:
+            return self.shapes[key]
+        except KeyError:
+            pass
+
+        if depth == 0 or c not in self.rules:
+            if c == 'F':
+                shape = None, 0.0, self.length, 0, [(0.0, 0.0), (0.0, self.length)]
+            elif c == '+':
+                shape = None, 0.0, 0.0, -self.turn % self.n, []
+            elif c == '-':
+                shape = None, 0.0, 0.0, self.turn % self.n, []
+            else:
+                shape = None, 0.0, 0.0, 0, []
+        else:
+            content, ex, ey, eh, hull = self.body(self.rules[c], depth - 1)
+            id = None
+            if hull:
+                id = '%s%d_%d' % (self.prefix, ord(c), depth)
+                if self.version:
+                    id += '_%d' % self.version
+                self.defs[id] = '<g id="%s">%s</g>' % (id, content)
+            shape = id, ex, ey, eh, hull
+
+        self.shapes[key] = shape
+        return shape
+
+    def update(self, rules):
+        """
+        forget the shapes using the rules changed since the last update,
+        the other shapes are reused
+
+        Returns:
+            the list of the definitions of the forgotten shapes
+
+        >>> i = _Instances({'F': 'F[+F]F'})
+        >>> content, ex, ey, eh, hull = i.body('F', 2)
+        >>> i.update({'F': 'F[+F]F', 'X': 'F'})
+        []
+        >>> len(i.update({'F': 'F[-F]F', 'X': 'F'}))
+        2
+        >>> print i.body('FX', 1)[0]
+        <use xlink:href="#s70_1_2"/><use xlink:href="#s88_1_2" transform="translate(0 20)"/>
+        """
+        changed = _changed_rules(self.rules, rules)
+        if changed:
+            for c in '[]':
+                if c in rules:
+                    raise ValueError('instances need rules without `%s`' % c)
+            self.version += 1
+        distances = _rule_distances(self.rules, changed)
+        ids = set()
+        for key in self.shapes.keys():
+            c, depth = key
+            if c in distances and distances[c] < depth:
+                ids.add(self.shapes.pop(key)[0])
+        forgotten = [self.defs.pop(id) for id in self.defs.keys() if id in ids]
+        self.rules = dict(rules)
+        return forgotten
+
+    def body(self, symbols, depth):
+        """
+        Returns:
+            (svg content, ex, ey, eh, hull) of the symbols expanded depth times
+        """
+        rcos = self.rcos
+        rsin = self.rsin
+        n = self.n
+
+        x = 0.0
+        y = 0.0
+        h = 0
+        stack = []
+        # path of the inline `F` and <use> of the other shapes
+        d = []
+        last = None
+        uses = []
+        points = []
+
+        for c in symbols:
+            if c == '[':
+                stack.append( (x, y, h) )
+                continue
+            if c == ']':
+                if len(stack) == 0:
+                    raise ValueError('inconsistant state: using to much `]`')
+                x, y, h = stack.pop()
+                continue
+
+            id, ex, ey, eh, hull = self.shape(c, depth)
+            ca = rcos[h]
+            sa = rsin[h]
+            x1 = x + ca * ex - sa * ey
+            y1 = y + sa * ex + ca * ey
+            if hull:
+                if id is None:
+                    if (x, y) != last:
+                        d.append('M%s %s' % (_svg_number(x), _svg_number(y)))
+                    d.append('L%s %s' % (_svg_number(x1), _svg_number(y1)))
+                    last = x1, y1
+                else:
+                    transform = []
+                    if x or y:
+                        transform.append('translate(%s %s)' % (_svg_number(x), _svg_number(y)))
+                    if h:
+                        transform.append('rotate(%s)' % _svg_number(_rotation(self.cos, h)))
+                    if transform:
+                        uses.append('<use xlink:href="#%s" transform="%s"/>' % (id, ' '.join(transform)))
+                    else:
+                        uses.append('<use xlink:href="#%s"/>' % id)
+                for px, py in hull:
+                    points.append((x + ca * px - sa * py, y + sa * px + ca * py))
+            x, y = x1, y1
+            h = (h + eh) % n
+
+        if stack:
+            raise ValueError('instances need rules with balanced brackets')
+
+        content = ''.join(uses)
+        if d:
+            content = '<path d="%s"/>' % ''.join(d) + content
+        return content, x, y, h, _convex_hull(points)
+
+
+
+class Plot:
+    """
+    Abstract Class for Lsystem ploting
+
+    All public func must return self to chain the call
+    """
+    # Stats instance to profile the draw, None to disable
+    stats = None
+    # False if the time of draw does not depend on the state, then
+    # draw_anytime does not refine the draw by branch depth
+    progressive = True
+
     def __init__(self):
         """
         reimplement in subclasses
@@ -461,6 +2508,17 @@ class Plot:
         self._lsystem.step(count)
         return self
 
+    def skip(self, count=1):
+        """
+        advance the lsystem count generations without deriving its state
+        when it can, for the draws which only need the generation
+
+        Returns:
+        	self
+        """
+        self._lsystem.skip(count)
+        return self
+
     def draw(self):
         """
         draw the current state
@@ -497,6 +2555,149 @@ class Plot:
         return self
 
 
+    def geometry(self, buffer=None):
+        """
+        Returns:
+            the Geometry of the current state, NumPy arrays of the
+            segments over one buffer, see Geometry
+
+        >>> p = PlotD0LSvg(lsystem=D0Lsystem('F', {'F': 'F[-F]'}))
+        >>> p.step().geometry().coords.tolist()
+        [[0.0, 0.0, 0.0, 10.0], [0.0, 10.0, -10.0, 10.0]]
+        """
+        stats = self.stats
+        if stats is not None:
+            start = time.time()
+
+        geometry = _geometry(self.lsystem().compact_state(), self.length, self.angle,
+                buffer=buffer, stats=stats)
+
+        if stats is not None:
+            stats.add('interpretation', time.time() - start)
+        return geometry
+
+    def draw_anytime(self, generation, deadline):
+        """
+        draw the state of a generation coarse to fine, within deadline
+        seconds if possible
+
+        - step the lsystem generation by generation while the next step
+          should end before half the deadline, and the draw of the trunk
+          of the next generation before the deadline
+        - draw the trunk of the state, without its branches, then draw
+          again with the deepest branches whose draw should end before
+          the deadline, until the whole state is drawn
+
+        The times are predicted from the previous step or draw, and a
+        step or a draw is never interrupted: the trunk is always drawn.
+        While stepping, the trunk is drawn each time it doubles to know
+        the draw rate.
+        Each draw replaces the previous one, so the last one is the best
+        picture available. self.report describes how far it got:
+
+            generation, depth: generation and branch depth of the draw
+            requested, max_depth: generation and branch depth asked
+            symbols, total: number of symbols drawn and of the state
+            complete: True if the whole requested state is drawn
+            levels: list of (depth, symbols, seconds) of the draws
+            time: seconds spent
+
+        Returns:
+            self
+
+        >>> l = D0Lsystem('X', {'X': 'F[+X]F[-X]FX', 'F': 'FF'})
+        >>> p = PlotD0LSvg(angle=25.7, lsystem=l)
+        >>> r = p.draw_anytime(5, 0).report
+        >>> r['generation'], r['depth'], r['complete']
+        (0, 0, False)
+        >>> r = p.draw_anytime(5, 60).report
+        >>> r['generation'], r['depth'] == r['max_depth'], r['complete']
+        (5, True, True)
+        >>> p.svg() == PlotD0LSvg(angle=25.7, lsystem=l).draw().svg()
+        True
+        """
+        begin = time.time()
+        end = begin + deadline
+        lsys = self.lsystem()
+
+        def draw(state, depth):
+            # draw state pruned at depth, or the lsystem itself if the
+            # draw does not depend on the state, and return its seconds
+            start = time.time()
+            if self.progressive:
+                self.lsystem(_State(_prune(state, depth)))
+            try:
+                self.reset().draw()
+            finally:
+                self.lsystem(lsys)
+            return time.time() - start
+
+        # coarse generations: the trunk is drawn again each time it
+        # doubles, to know the draw rate and to leave a picture of a lower
+        # generation, and the next step is taken only if the draw of its
+        # trunk, which grows like the last one, should end before the
+        # deadline
+        if lsys.generation > generation:
+            lsys.reset()
+        state = lsys.compact_state()
+        counts = _depth_symbols(state)
+        size = counts[0] if self.progressive else 1
+        growth = 1.0
+        predicted = 0
+        drawn = None
+        while lsys.generation < generation and not getattr(lsys, 'finished', False):
+            if drawn is None or size >= 2 * drawn[1]:
+                drawn = lsys.generation, size, draw(state, 0)
+            start = time.time()
+            rate = drawn[2] / max(drawn[1], 1)
+            if start + predicted >= begin + deadline / 2.0 or start + predicted + rate * size * growth >= end:
+                break
+            symbols = _symbols(state)
+            lsys.step()
+            seconds = time.time() - start
+            state = lsys.compact_state()
+            counts = _depth_symbols(state)
+            if self.progressive:
+                growth = float(counts[0]) / max(size, 1)
+                size = counts[0]
+            # the next generation grows like this one
+            predicted = seconds * _symbols(state) / max(symbols, 1)
+
+        total = counts[-1]
+        max_depth = len(counts) - 1
+        levels = []
+        depth = 0 if self.progressive else max_depth
+        if drawn is not None and drawn[0] == lsys.generation:
+            # this generation is already drawn
+            levels.append((depth, counts[depth], drawn[2]))
+        if self.progressive:
+            while not levels or depth < max_depth:
+                if levels:
+                    # deepest level whose draw should end before the deadline
+                    d, symbols, seconds = levels[-1]
+                    rate = seconds / max(symbols, 1)
+                    now = time.time()
+                    deeper = [d for d in xrange(max_depth, depth, -1) if now + rate * counts[d] < end]
+                    if not deeper:
+                        break
+                    depth = deeper[0]
+                levels.append((depth, counts[depth], draw(state, depth)))
+        elif not levels:
+            levels.append((depth, total, draw(state, depth)))
+
+        self.report = {
+            'generation': lsys.generation,
+            'requested': generation,
+            'depth': depth,
+            'max_depth': max_depth,
+            'symbols': levels[-1][1],
+            'total': total,
+            'complete': lsys.generation == generation and depth == max_depth,
+            'levels': levels,
+            'time': time.time() - begin,
+        }
+        return self
+
     def done(self):
         """
         NotImplementedError
@@ -508,10 +2709,11 @@ class PlotD0LTurtle(Plot):
     plot D0L with python turtle module
     """
 
-    def __init__(self, length=10, angle=90, colors=None, lsystem=None):
+    def __init__(self, length=10, angle=90, colors=None, lsystem=None, stats=None):
         import turtle
         self.length = length
         self.angle = angle
+        self.stats = stats
         if colors is None:
             self.colors = ['red', 'green', 'blue', 'orange', 'yellow', 'brown']
         if lsystem is not None:
@@ -569,7 +2771,7 @@ class PlotD0LTurtle(Plot):
         """
 
         # calculate de bounding box
-        self._box = _bounding_box(self.lsystem().state(), self.length, self.angle)
+        self._box = _bounding_box(self.lsystem().compact_state(), self.length, self.angle, self.stats)
         xmin, xmax, ymin, ymax = self._box
         # print "_box=%s" % (self._box,)
 
@@ -615,23 +2817,41 @@ class PlotD0LTurtle(Plot):
         import turtle
 
         state = self.lsystem().state()
+        stats = self.stats
+        if stats is not None:
+            start = time.time()
+
+        # heading is an index of _directions, 0 is north
+        turn, cos, sin = _directions(self.angle)
+        n = len(cos)
+        head = 0
+
         for c in state:
             if c == 'F':
                 turtle.forward(self.length)
             if c == '+':
-                turtle.right(self.angle)
+                head = (head - turn) % n
+                turtle.setheading(90 + _rotation(cos, head))
             if c == '-':
-                turtle.left(self.angle)
+                head = (head + turn) % n
+                turtle.setheading(90 + _rotation(cos, head))
+
+        if stats is not None:
+            # turtle interpretes and draws at once
+            stats.add('backend', time.time() - start)
+            stats.count('symbols', len(state))
+            stats.count('segments', sum(1 for c, k in _string_runs(state) if c == 'F'))
         return self
 
     def reset(self):
         """
-        move turtle to 0, 0
+        clear the drawing and move turtle to 0, 0
 
         Returns: 
             self
         """
         import turtle
+        turtle.clear()
         turtle.penup()
         turtle.home()
         turtle.pendown()
@@ -725,11 +2945,11 @@ class PlotD0LBranchTurtle(PlotD0LTurtle):
     Plot a D0Lsystem with graphic interpretation of branching with `[` and `]`
     """
 
-    def __init__(self, length=10, angle=90, colors=None, lsystem=None):
+    def __init__(self, length=10, angle=90, colors=None, lsystem=None, stats=None):
         """
 
         """
-        PlotD0LTurtle.__init__(self, length=length, angle=angle, colors=colors, lsystem=lsystem)
+        PlotD0LTurtle.__init__(self, length=length, angle=angle, colors=colors, lsystem=lsystem, stats=stats)
 
         # stack of draw `[` and `]`
         self.stack = []
@@ -749,23 +2969,44 @@ class PlotD0LBranchTurtle(PlotD0LTurtle):
         import turtle
 
         state = self.lsystem().state()
+        stats = self.stats
+        if stats is not None:
+            start = time.time()
+        depth = 0
+
+        # heading is an index of _directions, 0 is north
+        turn, cos, sin = _directions(self.angle)
+        n = len(cos)
+        head = 0
+
         for c in state:
             if c == 'F':
                 turtle.forward(self.length)
             if c == '+':
-                turtle.right(self.angle)
+                head = (head - turn) % n
+                turtle.setheading(90 + _rotation(cos, head))
             if c == '-':
-                turtle.left(self.angle)
+                head = (head + turn) % n
+                turtle.setheading(90 + _rotation(cos, head))
             if c == '[':
-                self.stack.append((turtle.position(), turtle.heading()))
+                self.stack.append((turtle.position(), head))
+                if len(self.stack) > depth:
+                    depth = len(self.stack)
             if c == ']':
                 if len(self.stack) == 0:
                     raise ValueError('inconsistant state: using to much `]`')
                 pos, head = self.stack.pop()
                 turtle.penup()
                 turtle.setpos(pos)
-                turtle.setheading(head)
+                turtle.setheading(90 + _rotation(cos, head))
                 turtle.pendown()
+
+        if stats is not None:
+            # turtle interpretes and draws at once
+            stats.add('backend', time.time() - start)
+            stats.count('symbols', len(state))
+            stats.count('segments', sum(1 for c, k in _string_runs(state) if c == 'F'))
+            stats.maximum('max_stack_depth', depth)
         return self
 
 
@@ -774,7 +3015,7 @@ class PlotD0LTkinter(Plot):
     Draw a D0Lsystem using Tkinter Canvas
     """
 
-    def __init__(self, length=10, angle=90, colors=None, lsystem=None):
+    def __init__(self, length=10, angle=90, colors=None, lsystem=None, stats=None):
         import Tkinter
 
 		## geometric attrs
@@ -795,6 +3036,8 @@ class PlotD0LTkinter(Plot):
         self._bbox = 0, 0, 0, 0
         # width and height
         self.size = [0, 0]
+        # profiling
+        self.stats = stats
 
         # lsystem
         if lsystem is not None:
@@ -822,37 +3065,56 @@ class PlotD0LTkinter(Plot):
         # + resize length if to big
         screen_width = self.root.winfo_screenwidth()
         screen_height = self.root.winfo_screenheight()
+        self._fit(screen_width, screen_height)
 
-        length = self.length
-       
-        # adapte draw for screen size
-        xmin, xmax, ymin, ymax = _bounding_box(self.lsystem().state(), self.length, self.angle)
-        while xmax - xmin > screen_width or ymax - ymin > screen_height:
-            self.length *= .5
-            xmin, xmax, ymin, ymax = _bounding_box(self.lsystem().state(), self.length, self.angle)
+        self._pack_canvas()
+        self.draw_root()
+        self.draw_state()
+        return self
 
-            print "Draw too big ... reducing"
+    def draw_async(self, count=0, batch=500, interval=20, maxsize=100):
+        """
+        draw process without freezing the window
+        - a worker thread steps <count> generations, calculates the
+          bounding box and the segments of the current state
+        - the segments are sent to Tk by batches of <batch> through a queue
+          of at most <maxsize> messages: the worker waits while it is full
+        - Tk draws the received batches every <interval> ms and shows
+          the progress in the window title
 
-        self._bbox = xmin, xmax, ymin, ymax
-        self.size = xmax - xmin, ymax - ymin
+        <Escape> or cancel() stops the draw, the lines already drawn stay.
 
-        # print "size=%s" % (self.size,)
+        Returns:
+        	self
+        """
+        import threading
+        import Queue
 
-        # change origin to translate draw in positive x, y
-        if xmin < 0:
-            self.origin[0] -= xmin
-        if ymin < 0:
-            self.origin[1] -= ymin
+        self._queue = Queue.Queue(maxsize)
+        self._cancel = threading.Event()
+        self.root.bind('<Escape>', self._on_cancel)
 
-        # change canvas geometry
-        self.canvas['width']  = max(self.size[0], 50)
-        self.canvas['height'] = max(self.size[1], 50)
-        self.canvas.pack()
+        # Tk must only be used in the main thread
+        screen = self.root.winfo_screenwidth(), self.root.winfo_screenheight()
+        worker = threading.Thread(target=self._worker, args=(count, batch, screen))
+        worker.daemon = True
+        worker.start()
 
-        # print "canvas=%s" % self.canvas.config()
+        self.root.title('pylsys: starting')
+        self.root.after(interval, self._poll, interval)
+        return self
 
-        self.draw_root()
-        self.draw_state()
+    def cancel(self):
+        """
+        cancel the draw started by draw_async; the worker stops at the
+        next generation, during the bounding box, at the next batch of
+        segments or while it waits for room in the queue
+
+        Returns:
+        	self
+        """
+        if getattr(self, '_cancel', None) is not None:
+            self._cancel.set()
         return self
 
     def done(self):
@@ -893,55 +3155,45 @@ class PlotD0LTkinter(Plot):
         """
         # virtual turtle
         x, y = self.origin
-        head = 90
 
         # lsystem
-        state = self.lsystem().state()
-        length = self.length
-        angle = self.angle
-
-        stack = []
-        flength = float(length)
+        state = self.lsystem().compact_state()
 
         # canvas
         canvas = self.canvas
         # kargs_line = {'outline': self.color}
         kargs_line = {}
 
-        for c in state:
-            if c == 'F':
-                if angle == 90:
-                    if head % 360 == 0:
-                        x1, y1 = x + flength, y
-                    if head % 360 == 90:
-                        x1, y1 = x, y + flength
-                    if head % 360 == 180:
-                        x1, y1 = x - flength, y
-                    if head % 360 == 270:
-                        x1, y1 = x, y - flength
-                else:
-                    angle_rad = math.radians(head)
-                    x1 = x + math.cos(angle_rad) * flength
-                    y1 = y + math.sin(angle_rad) * flength
-                p0 = self._turtle2tk_coords(x, y)
+        # final position and heading of the turtle
+        end = []
+        stats = self.stats
+        if stats is None:
+            # without profiling, the lines are submitted as interpreted
+            for x0, y0, x1, y1 in _segments(state, self.length, self.angle, x, y, end=end):
+                canvas.create_line(self._turtle2tk_coords(x0, y0),
+                        self._turtle2tk_coords(x1, y1), **kargs_line)
+        else:
+            start = time.time()
+
+            # interpretation: list of tk segments
+            lines = []
+            for x0, y0, x1, y1 in _segments(state, self.length, self.angle, x, y, stats, end):
+                p0 = self._turtle2tk_coords(x0, y0)
                 p1 = self._turtle2tk_coords(x1, y1)
-                canvas.create_line(p0, p1, **kargs_line)
-                x, y = x1, y1
-            if c == '+':
-                head = (head - angle + 360) % 360
-            if c == '-':
-                head = (head + angle) % 360
-            if c == '[':
-                stack.append( (x, y, head) )
-            if c == ']':
-                if len(stack) == 0:
-                    raise ValueError('inconsistant state: using to much `]`')
-                x, y, head = stack.pop()
+                lines.append((p0, p1))
 
-        self.origin = x, y
-        self.head = head
+            stop = time.time()
+            stats.add('interpretation', stop - start)
+            start = stop
 
+            # backend: submit the segments to the canvas
+            for p0, p1 in lines:
+                canvas.create_line(p0, p1, **kargs_line)
 
+            stats.add('backend', time.time() - start)
+
+        self.origin = end[0], end[1]
+        self.head = end[2]
         return self
 
     def nextdraw(self):
@@ -965,17 +3217,170 @@ class PlotD0LTkinter(Plot):
 
     def reset(self):
         """
-        Reset context
+        Reset context: clear the canvas
 
         Returns: 
              self
         """
+        self.canvas.delete('all')
+        self.origin = [0, 0]
         return self
 
     ###
     # private geometric function
     ###
 
+    def _fit(self, screen_width, screen_height, cancel=None):
+        """
+        calculate the bounding box and the size of the current state,
+        halving length until the draw fits in the screen
+
+        The state is walked once: halving length halves exactly the
+        float bounding box. With a cancel event, raise _Cancelled soon
+        after it is set.
+
+        set self._bbox, self.size and self.origin; does not use Tk
+        """
+        stats = self.stats
+        if stats is not None:
+            start = time.time()
+
+        box = _bounding_box_float(self.lsystem().compact_state(), self.length, self.angle, cancel)
+
+        if stats is not None:
+            stats.add('bbox', time.time() - start)
+
+        xmin, xmax, ymin, ymax = _bounding_box_int(*box)
+        while xmax - xmin > screen_width or ymax - ymin > screen_height:
+            if cancel is not None and cancel.is_set():
+                raise _Cancelled
+            self.length *= .5
+            box = [v * .5 for v in box]
+            xmin, xmax, ymin, ymax = _bounding_box_int(*box)
+
+            print "Draw too big ... reducing"
+
+        self._bbox = xmin, xmax, ymin, ymax
+        self.size = xmax - xmin, ymax - ymin
+
+        # print "size=%s" % (self.size,)
+
+        # change origin to translate draw in positive x, y
+        if xmin < 0:
+            self.origin[0] -= xmin
+        if ymin < 0:
+            self.origin[1] -= ymin
+
+    def _pack_canvas(self):
+        """
+        change canvas geometry to self.size
+        """
+        self.canvas['width']  = max(self.size[0], 50)
+        self.canvas['height'] = max(self.size[1], 50)
+        self.canvas.pack()
+
+        # print "canvas=%s" % self.canvas.config()
+
+    ###
+    # private thread functions
+    ###
+
+    def _worker(self, count, batch, screen):
+        """
+        body of the worker thread of draw_async
+
+        put in self._queue the messages (kind, data):
+            ('progress', text)
+            ('size', None): self.size and self.origin are set
+            ('segments', list of tk lines (x0, y0, x1, y1))
+            ('done', None), ('cancelled', None) or ('error', exception)
+        """
+        import Queue
+
+        put = self._put
+        try:
+            lsys = self.lsystem()
+            for i in xrange(count):
+                put(('progress', 'rewriting generation %d/%d' % (i + 1, count)))
+                lsys.step()
+
+            put(('progress', 'bounding box'))
+            self._fit(screen[0], screen[1], self._cancel)
+            put(('size', None))
+
+            state = lsys.compact_state()
+            height = self.size[1]
+            done = 0
+            segments = _segments(state, self.length, self.angle, *self.origin)
+            for lines in _batches(segments, batch):
+                put(('segments', [(x0, height - y0, x1, height - y1)
+                    for x0, y0, x1, y1 in lines]))
+                done += len(lines)
+                put(('progress', 'segments %d' % done))
+            put(('done', None))
+        except _Cancelled:
+            # _poll does not read the queue anymore, it may be full
+            try:
+                self._queue.put_nowait(('cancelled', None))
+            except Queue.Full:
+                pass
+        except Exception, e:
+            try:
+                put(('error', e))
+            except _Cancelled:
+                pass
+
+    def _put(self, message, timeout=0.1):
+        """
+        put message in self._queue, waiting while it is full, raise
+        _Cancelled once the draw is cancelled
+        """
+        import Queue
+
+        while True:
+            if self._cancel.is_set():
+                raise _Cancelled
+            try:
+                self._queue.put(message, timeout=timeout)
+                return
+            except Queue.Full:
+                pass
+
+    def _poll(self, interval):
+        """
+        after() callback of draw_async: draw the batches received from the
+        worker during at most <interval> ms, then reschedule itself
+        """
+        import Queue
+
+        canvas = self.canvas
+        stop = time.time() + interval / 1000.
+        while time.time() < stop:
+            try:
+                kind, data = self._queue.get_nowait()
+            except Queue.Empty:
+                break
+            if kind == 'segments':
+                for line in data:
+                    canvas.create_line(*line)
+            elif kind == 'progress':
+                self.root.title('pylsys: %s' % data)
+            elif kind == 'size':
+                self._pack_canvas()
+                self.draw_root()
+            else:
+                if kind == 'error':
+                    self.root.title('pylsys: error %s' % data)
+                else:
+                    self.root.title('pylsys: %s' % kind)
+                return
+
+        if self._cancel.is_set():
+            # stop drawing now, the worker will stop by itself
+            self.root.title('pylsys: cancelled')
+            return
+        self.root.after(interval, self._poll, interval)
+
     def _turtle2tk_coords(self, x, y):
         """
         transform coords in turtle coords to tk coords
@@ -1012,6 +3417,1375 @@ class PlotD0LTkinter(Plot):
         """
         ev['widget'].withdraw()
 
+    def _on_cancel(self, ev):
+        """
+        handler to cancel the draw_async
+        """
+        self.cancel()
+
+
+class PlotD0LSvg(Plot):
+    """
+    Draw a D0Lsystem in a SVG document
+
+    Nothing is displayed, so it works without screen (batch, server ...)
+
+    >>> p = PlotD0LSvg(lsystem=D0Lsystem('F', {'F': 'F[+F]F'}))
+    >>> print p.step().draw().svg()
+    <?xml version="1.0" encoding="UTF-8"?>
+    <svg xmlns="http://www.w3.org/2000/svg" viewBox="-1 -21 12 22">
+    <path fill="none" stroke="red" stroke-width="1" d="M0 0L0 -10L10 -10M0 -10L0 -20"/>
+    </svg>
+    """
+
+    def __init__(self, length=10, angle=90, colors=None, lsystem=None, stats=None, filename=None, width=1, instances=False):
+        """
+        Args:
+            filename: the SVG document is written in filename by done()
+            width: width of the lines
+            instances: with a D0Lsystem, define each shape of a symbol
+                expanded n times once and place its copies with <use>
+        """
+        self.length = length
+        self.angle = angle
+        if colors is None:
+            self.colors = ['red', 'green', 'blue', 'orange', 'yellow', 'brown']
+        else:
+            self.colors = colors
+        self.stats = stats
+        self.filename = filename
+        self.width = width
+        self.instances = instances
+        # shapes are drawn from the rules
+        self.progressive = not instances
+
+        # draw number
+        self.ith_draw = 0
+        # origin of next draw
+        self.origin = [0, 0]
+        # bounding box of the last draw
+        self._box = 0, 0, 0, 0
+        # bounding box of the document
+        self._bbox = None
+        # list of (color, path data)
+        self.paths = []
+        # with instances: list of (color, content, x, y), the _Instances
+        # used by the groups and the definitions of their shapes forgotten
+        # after a change of the rules, still used by the groups
+        self.groups = []
+        self._used = []
+        self.defs = []
+        # _Instances by length and angle, the last used at the end: the
+        # last one is kept by reset, so its shapes are reused by the next
+        # draws; and number of _Instances created, for their prefixes
+        self._instances = []
+        self._prefixes = 0
+
+        if lsystem is not None:
+            self.lsystem(lsystem)
+
+    def draw(self):
+        """
+        draw process
+        - calculate the bounding box of the current state
+        - draw the current state at the right of the previous draws
+
+        Returns:
+            self
+        """
+        if self.instances:
+            content, self._box = self._draw_instances()
+        else:
+            self._box = _bounding_box(self.lsystem().compact_state(), self.length, self.angle, self.stats)
+        xmin, xmax, ymin, ymax = self._box
+
+        # translate draw in positive x from origin
+        x0 = self.origin[0] - xmin
+        y0 = self.origin[1]
+        box = x0 + xmin, x0 + xmax, y0 + ymin, y0 + ymax
+        if self._bbox is None:
+            self._bbox = box
+        else:
+            self._bbox = (min(self._bbox[0], box[0]), max(self._bbox[1], box[1]),
+                    min(self._bbox[2], box[2]), max(self._bbox[3], box[3]))
+
+        if self.instances:
+            self.groups.append((self.colors[self.ith_draw % len(self.colors)], content, x0, y0))
+        else:
+            self.draw_state(x0, y0)
+        return self
+
+    def _draw_instances(self):
+        """
+        define the shapes of the current state with _Instances
+
+        Returns:
+            (svg content, bounding box) of the current state from 0, 0
+
+        >>> l = D0Lsystem('X', {'X': 'F[+X][-X]FX', 'F': 'FF'})
+        >>> p = PlotD0LSvg(angle=25.7, lsystem=l, instances=True).skip(6)
+        >>> content, box = p._draw_instances()
+        >>> l._current_state is None
+        True
+        >>> box == _bounding_box(l.state(), 10, 25.7)
+        True
+        >>> len(p._instances[0].defs)
+        11
+
+        after a change of the rule of X, the shapes of F are reused
+
+        >>> s = l.set_rule('X', 'F[-X][+X]FX')
+        >>> content, box = p.reset()._draw_instances()
+        >>> box == _bounding_box(l.state(), 10, 25.7)
+        True
+        >>> sorted(set(c for c, depth in p._instances[0].shapes))
+        ['+', '-', 'F', 'X']
+        >>> len(p.svg().split('<g id=')) - 1
+        11
+        """
+        lsys = self.lsystem()
+        if not isinstance(lsys, D0Lsystem):
+            raise TypeError('instances need a D0Lsystem')
+        stats = self.stats
+        if stats is not None:
+            start = time.time()
+
+        instances = None
+        for i in self._instances:
+            if i.length == float(self.length) and i.angle == self.angle:
+                instances = i
+        if instances is None:
+            instances = _Instances(lsys.rules, self.length, self.angle, 'i%d_' % self._prefixes)
+            self._prefixes += 1
+        else:
+            self._instances.remove(instances)
+            forgotten = instances.update(lsys.rules)
+            if instances in self._used:
+                self.defs.extend(forgotten)
+        self._instances.append(instances)
+        if instances not in self._used:
+            self._used.append(instances)
+        content, ex, ey, eh, hull = instances.body(lsys.axiom, lsys.generation)
+
+        # the root is in the box, like in _bounding_box
+        xs = [0.0] + [x for x, y in hull]
+        ys = [0.0] + [y for x, y in hull]
+        box = _bounding_box_int(min(xs), max(xs), min(ys), max(ys))
+
+        if stats is not None:
+            stats.add('interpretation', time.time() - start)
+            stats.count('instances', len(instances.defs))
+        return content, box
+
+    def draw_state(self, x=0, y=0):
+        """
+        the core of the class: add a path of the current state from x, y
+
+        Returns:
+            self
+        """
+        state = self.lsystem().compact_state()
+        stats = self.stats
+        if stats is not None:
+            start = time.time()
+
+        # interpretation: svg path data, y axis is down
+        d = []
+        last = None
+        for x0, y0, x1, y1 in _segments(state, self.length, self.angle, x, y, stats):
+            if (x0, y0) != last:
+                d.append('M%s %s' % (_svg_number(x0), _svg_number(-y0)))
+            d.append('L%s %s' % (_svg_number(x1), _svg_number(-y1)))
+            last = x1, y1
+
+        if stats is not None:
+            stop = time.time()
+            stats.add('interpretation', stop - start)
+            start = stop
+
+        # backend
+        self.paths.append((self.colors[self.ith_draw % len(self.colors)], ''.join(d)))
+
+        if stats is not None:
+            stats.add('backend', time.time() - start)
+        return self
+
+    def svg(self, size=None):
+        """
+        Args:
+            size: (width, height) of the image, the draws are scaled to
+                fit in it, None to use the units of the draws
+
+        Returns:
+            the SVG document as a string
+
+        >>> p = PlotD0LSvg(lsystem=D0Lsystem('F', {'F': 'FF'})).draw()
+        >>> p.svg((100, 50)).split('\\n')[1]
+        '<svg xmlns="http://www.w3.org/2000/svg" width="100" height="50" viewBox="-1 -11 2 12">'
+        """
+        if self._bbox is None:
+            xmin, xmax, ymin, ymax = 0, 0, 0, 0
+        else:
+            xmin, xmax, ymin, ymax = self._bbox
+        # margin of 1 around the draws
+        defs = self.defs + [d for i in self._used for d in i.defs.values()]
+        attributes = ''
+        if defs:
+            attributes = ' xmlns:xlink="http://www.w3.org/1999/xlink"'
+        if size is not None:
+            attributes += ' width="%d" height="%d"' % tuple(size)
+        lines = [
+            '<?xml version="1.0" encoding="UTF-8"?>',
+            '<svg xmlns="http://www.w3.org/2000/svg"%s viewBox="%d %d %d %d">' % (
+                attributes, xmin - 1, -ymax - 1, xmax - xmin + 2, ymax - ymin + 2),
+        ]
+        for color, d in self.paths:
+            lines.append('<path fill="none" stroke="%s" stroke-width="%s" d="%s"/>' % (
+                color, self.width, d))
+        if defs:
+            lines.append('<defs>')
+            lines.extend(defs)
+            lines.append('</defs>')
+        # shapes are drawn with y axis up
+        for color, content, x, y in self.groups:
+            lines.append('<g fill="none" stroke="%s" stroke-width="%s" transform="matrix(1 0 0 -1 %s %s)">%s</g>' % (
+                color, self.width, _svg_number(x), _svg_number(-y), content))
+        lines.append('</svg>')
+        return '\n'.join(lines)
+
+    def nextdraw(self):
+        """
+        Prepare the next draw at the right of the current one with the next color
+
+        Returns:
+            self
+        """
+        xmin, xmax, ymin, ymax = self._box
+        self.origin[0] += 10 + xmax - xmin
+        self.ith_draw += 1
+        return self
+
+    def pencolor(self, p=None):
+        """
+        Set/Get the pencolor
+
+        Returns:
+            self
+        """
+        if p is not None:
+            self.colors = [p]
+        return self
+
+    def reset(self):
+        """
+        Clear the document
+
+        Returns:
+            self
+        """
+        self.ith_draw = 0
+        self.origin = [0, 0]
+        self._box = 0, 0, 0, 0
+        self._bbox = None
+        self.paths = []
+        self.groups = []
+        self._used = []
+        self.defs = []
+        self._instances = self._instances[-1:]
+        return self
+
+    def done(self):
+        """
+        write the SVG document in filename, if any
+
+        Returns:
+            self
+        """
+        if self.filename is not None:
+            f = open(self.filename, 'w')
+            try:
+                f.write(self.svg())
+            finally:
+                f.close()
+        return self
+
+def _svg_number(f):
+    """
+    short string of a coordinate
+
+    >>> _svg_number(10.0), _svg_number(-0.0), _svg_number(1.23456)
+    ('10', '0', '1.235')
+    """
+    s = '%.3f' % f
+    s = s.rstrip('0').rstrip('.')
+    if s == '-0':
+        s = '0'
+    return s
+
+
+class PlotD0LTiles(Plot):
+    """
+    Draw a D0Lsystem in PNG tiles, for images too big for the memory
+    or the screen
+
+    The image of the current state at <scale> pixels by unit is cut in
+    tiles of <tile> x <tile> pixels. The segments are routed to the tiles
+    they may cross with their bounding box, by bands of rows of tiles of
+    up to band_segments segments, with a walk of the state by band, and
+    a pool of <processes> processes draws a row while the next one is
+    routed. Each process writes its tiles in <directory> as soon as they
+    are finished, so only the segments of a band and a row are in memory
+    at once. <directory>/index.json describes the tiles grid.
+
+    >>> import tempfile, shutil, os, json
+    >>> d = tempfile.mkdtemp()
+    >>> l = D0Lsystem('F', {'F': 'F[+F]F[-F]F'})
+    >>> p = PlotD0LTiles(angle=25.7, lsystem=l, directory=d, tile=64, processes=1)
+    >>> index = p.step(3).draw().done().index
+    >>> index['width'], index['height'], index['rows'], index['cols']
+    (95, 273, 5, 2)
+    >>> sorted(os.listdir(d))[:3]
+    ['0_0.png', '0_1.png', '1_0.png']
+    >>> shutil.rmtree(d)
+    """
+
+    # number of routed segments of a band of rows of tiles
+    band_segments = 1 << 20
+
+    def __init__(self, length=10, angle=90, lsystem=None, stats=None, directory='tiles', scale=1.0, tile=256, processes=None):
+        """
+        Args:
+            directory: directory of the tiles, created if needed
+            scale: pixels by unit of length
+            tile: size of the tiles in pixels
+            processes: number of drawing processes, None for the number
+                of CPUs and 1 to draw in the current process
+        """
+        self.length = length
+        self.angle = angle
+        self.stats = stats
+        self.directory = directory
+        self.scale = scale
+        self.tile = tile
+        self.processes = processes
+
+        # description of the tiles of the last draw
+        self.index = None
+
+        if lsystem is not None:
+            self.lsystem(lsystem)
+
+    def draw(self):
+        """
+        draw process
+        - calculate the bounding box and the size of the image
+        - route the segments of the current state to the tiles
+        - draw and write the tiles with a pool of processes
+
+        Returns:
+            self
+        """
+        import multiprocessing
+
+        state = self.lsystem().compact_state()
+        stats = self.stats
+        xmin, xmax, ymin, ymax = _bounding_box(state, self.length, self.angle, stats)
+
+        # image with a margin of 1 pixel, y axis is down
+        scale = float(self.scale)
+        tile = self.tile
+        width = int(math.ceil((xmax - xmin) * scale)) + 3
+        height = int(math.ceil((ymax - ymin) * scale)) + 3
+        cols = (width + tile - 1) // tile
+        rows = (height + tile - 1) // tile
+
+        if stats is not None:
+            start = time.time()
+        # seconds spent in routing, the rest is drawing
+        routing = [0.0]
+        rows_tasks = self._rows_tasks(state, xmin, ymax, scale, width, height, routing)
+
+        if self.processes == 1:
+            for tasks in rows_tasks:
+                for task in tasks:
+                    _draw_tile(task)
+        else:
+            pool = multiprocessing.Pool(self.processes)
+            try:
+                # the next row is routed while the pool draws this one
+                pending = None
+                for tasks in rows_tasks:
+                    if pending is not None:
+                        pending.get()
+                    pending = pool.map_async(_draw_tile, tasks)
+                if pending is not None:
+                    pending.get()
+                pool.close()
+            except:
+                pool.terminate()
+                raise
+            finally:
+                pool.join()
+
+        if stats is not None:
+            stats.add('interpretation', routing[0])
+            stats.add('backend', time.time() - start - routing[0])
+
+        self.index = {
+            'width': width,
+            'height': height,
+            'tile': tile,
+            'rows': rows,
+            'cols': cols,
+            'scale': scale,
+            'bbox': [xmin, xmax, ymin, ymax],
+            'tiles': '{row}_{col}.png',
+        }
+        return self
+
+    def _rows_tasks(self, state, xmin, ymax, scale, width, height, routing):
+        """
+        Generator of the list of tasks of _draw_tile of each row of
+        tiles, routed by bands of rows when the first row is asked
+
+        Args:
+            routing: list of the seconds spent in routing, incremented
+        """
+        import os
+
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+        start = time.time()
+        tile = self.tile
+        cols = (width + tile - 1) // tile
+        rows = (height + tile - 1) // tile
+        counts = self._row_counts(state, xmin, ymax, scale, rows)
+        routing[0] += time.time() - start
+
+        first = 0
+        while first < rows:
+            start = time.time()
+            last = first + 1
+            band = counts[first]
+            while last < rows and band + counts[last] <= self.band_segments:
+                band += counts[last]
+                last += 1
+            tiles = self._route(state, xmin, ymax, scale, first, last, cols)
+            routing[0] += time.time() - start
+            for r in xrange(first, last):
+                tasks = []
+                for c in xrange(cols):
+                    path = os.path.join(self.directory, '%d_%d.png' % (r, c))
+                    w = min(tile, width - c * tile)
+                    h = min(tile, height - r * tile)
+                    tasks.append((path, c * tile, r * tile, w, h, tiles.pop((r, c), None)))
+                # no more reference on the segments but in tasks
+                yield tasks
+            first = last
+
+    def _pixel_segments(self, state, xmin, ymax, scale, stats=None):
+        """
+        Generator of the pixel coords x0, y0, x1, y1 of the segments
+        """
+        for x0, y0, x1, y1 in _segments(state, self.length, self.angle, 0, 0, stats):
+            yield ((x0 - xmin) * scale + 1, (ymax - y0) * scale + 1,
+                    (x1 - xmin) * scale + 1, (ymax - y1) * scale + 1)
+
+    def _row_counts(self, state, xmin, ymax, scale, rows):
+        """
+        Returns:
+            list of the number of segments crossing each row of tiles
+        """
+        tile = float(self.tile)
+        counts = [0] * rows
+        for x0, y0, x1, y1 in self._pixel_segments(state, xmin, ymax, scale, self.stats):
+            r0 = max(int(min(y0, y1) // tile), 0)
+            r1 = min(int(max(y0, y1) // tile), rows - 1)
+            for r in xrange(r0, r1 + 1):
+                counts[r] += 1
+        return counts
+
+    def _route(self, state, xmin, ymax, scale, first, last, cols):
+        """
+        Returns:
+            dict (row, col) -> array of the pixel coords x0, y0, x1, y1
+            of the segments crossing the bounding box of the tile, for
+            the rows from first to last excluded
+        """
+        import array
+
+        tile = float(self.tile)
+        tiles = {}
+        for x0, y0, x1, y1 in self._pixel_segments(state, xmin, ymax, scale):
+            r0 = max(int(min(y0, y1) // tile), first)
+            r1 = min(int(max(y0, y1) // tile), last - 1)
+            if r0 > r1:
+                continue
+            c0 = max(int(min(x0, x1) // tile), 0)
+            c1 = min(int(max(x0, x1) // tile), cols - 1)
+            for r in xrange(r0, r1 + 1):
+                for c in xrange(c0, c1 + 1):
+                    segments = tiles.get((r, c))
+                    if segments is None:
+                        segments = tiles[r, c] = array.array('f')
+                    segments.extend((x0, y0, x1, y1))
+        return tiles
+
+    def done(self):
+        """
+        write the description of the tiles in directory/index.json
+
+        Returns:
+            self
+        """
+        import os
+
+        if self.index is not None:
+            f = open(os.path.join(self.directory, 'index.json'), 'w')
+            try:
+                json.dump(self.index, f, indent=1, sort_keys=True)
+            finally:
+                f.close()
+        return self
+
+    def nextdraw(self):
+        """
+        a draw replaces the previous tiles
+
+        Returns:
+            self
+        """
+        return self
+
+    def reset(self):
+        """
+        Returns:
+            self
+        """
+        self.index = None
+        return self
+
+def _draw_tile(task):
+    """
+    draw the segments of a tile and write it in a PNG file, for the pool
+    of PlotD0LTiles
+
+    Args:
+        task: (path, x, y, width, height, segments) with x, y the pixel
+        position of the tile and segments an array of x0, y0, x1, y1
+
+    >>> import tempfile, os, zlib
+    >>> path = tempfile.mktemp('.png')
+    >>> _draw_tile((path, 0, 0, 4, 3, [0.5, 1.5, 3.5, 1.5]))
+    >>> data = open(path, 'rb').read()
+    >>> os.remove(path)
+    >>> [ord(c) for c in zlib.decompress(data[41:-12])]
+    [0, 255, 255, 255, 255, 0, 0, 0, 0, 0, 0, 255, 255, 255, 255]
+    """
+    path, tx, ty, width, height, segments = task
+    pixels = bytearray('\xff' * (width * height))
+    if segments:
+        xmax = float(width)
+        ymax = float(height)
+        for i in xrange(0, len(segments), 4):
+            # segment in tile coords, clipped to the tile
+            clipped = _clip(segments[i] - tx, segments[i + 1] - ty,
+                    segments[i + 2] - tx, segments[i + 3] - ty, xmax, ymax)
+            if clipped is None:
+                continue
+            x0, y0, x1, y1 = clipped
+            # DDA: one pixel by step on the longest axis
+            n = int(max(abs(x1 - x0), abs(y1 - y0))) + 1
+            dx = (x1 - x0) / n
+            dy = (y1 - y0) / n
+            for j in xrange(n + 1):
+                px = int(x0 + dx * j)
+                py = int(y0 + dy * j)
+                if 0 <= px < width and 0 <= py < height:
+                    pixels[py * width + px] = 0
+    _write_png(path, width, height, pixels)
+
+def _clip(x0, y0, x1, y1, xmax, ymax):
+    """
+    clip a segment to the rectangle 0, 0, xmax, ymax (Liang-Barsky)
+
+    Returns:
+        (x0, y0, x1, y1) or None if the segment is outside
+
+    >>> _clip(-5, 1, 5, 1, 2, 2)
+    (0.0, 1.0, 2.0, 1.0)
+    >>> _clip(-5, 3, 5, 3, 2, 2) is None
+    True
+    """
+    dx = x1 - x0
+    dy = y1 - y0
+    t0 = 0.0
+    t1 = 1.0
+    for p, q in ((-dx, x0), (dx, xmax - x0), (-dy, y0), (dy, ymax - y0)):
+        if p == 0:
+            if q < 0:
+                return None
+            continue
+        t = float(q) / p
+        if p < 0:
+            if t > t1:
+                return None
+            t0 = max(t0, t)
+        else:
+            if t < t0:
+                return None
+            t1 = min(t1, t)
+    return x0 + t0 * dx, y0 + t0 * dy, x0 + t1 * dx, y0 + t1 * dy
+
+def _write_png(path, width, height, pixels):
+    """
+    write a 8 bits gray PNG image
+
+    Args:
+        pixels: bytearray of width * height pixels, row by row
+    """
+    import struct
+    import zlib
+
+    def chunk(tag, data):
+        crc = zlib.crc32(tag + data) & 0xffffffff
+        return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', crc)
+
+    raw = bytearray()
+    for y in xrange(height):
+        # filter type 0
+        raw.append(0)
+        raw.extend(pixels[y * width:(y + 1) * width])
+
+    f = open(path, 'wb')
+    try:
+        f.write('\x89PNG\r\n\x1a\n')
+        f.write(chunk('IHDR', struct.pack('>IIBBBBB', width, height, 8, 0, 0, 0, 0)))
+        f.write(chunk('IDAT', zlib.compress(str(raw), 6)))
+        f.write(chunk('IEND', ''))
+    finally:
+        f.close()
+
+
+class PlotD0L3D(Plot):
+    """
+    Draw a D0Lsystem in 3D and export the mesh in OBJ or PLY
+
+    The turtle has a frame: heading H, left L and up U. It starts at the
+    origin heading to y with U toward z, so a state without 3D symbols
+    gives the same draw as the 2D plots in the plane z = 0.
+
+    - `+`, `-`: turn right, left around U
+    - `&`, `^`: pitch down, up around L
+    - `\\`, `/`: roll left, right around H
+    - `|`: turn around U
+    - `[`, `]`: push, pop position and frame
+
+    With a radius, branches are exported as tubes of <sides> faces,
+    otherwise as lines.
+
+    >>> l = D0Lsystem('F', {'F': 'F[&F][^F]'})
+    >>> p = PlotD0L3D(angle=90, lsystem=l).step().draw()
+    >>> p.bounding_box()
+    (0.0, 0.0, 0.0, 10.0, -10.0, 10.0)
+    >>> import StringIO
+    >>> f = StringIO.StringIO()
+    >>> p.obj(f) is p
+    True
+    >>> print f.getvalue()
+    v 0 0 0
+    v 0 10 0
+    v 0 10 -10
+    v 0 10 10
+    l 1 2
+    l 2 3
+    l 2 4
+    <BLANKLINE>
+    >>> vertices, faces = p.tubes()
+    >>> vertices.shape, faces.shape
+    ((36, 3), (18, 4))
+    """
+
+    def __init__(self, length=10, angle=90, lsystem=None, stats=None, filename=None, radius=0, sides=6):
+        """
+        Args:
+            filename: the mesh is written in filename by done(), in OBJ
+                or PLY with its extension .obj or .ply
+            radius: radius of the tubes, 0 for lines
+            sides: number of faces of the tubes
+        """
+        self.length = length
+        self.angle = angle
+        self.stats = stats
+        self.filename = filename
+        self.radius = radius
+        self.sides = sides
+
+        # origin of next draw
+        self.origin = [0, 0]
+        # bounding box of the last draw
+        self._box = 0, 0, 0, 0, 0, 0
+        # list of (vertices, segments) of the draws
+        self.meshes = []
+
+        if lsystem is not None:
+            self.lsystem(lsystem)
+
+    def draw(self):
+        """
+        draw process
+        - interpret the current state in vertices and segments
+        - place the draw at the right of the previous draws
+
+        Returns:
+            self
+        """
+        stats = self.stats
+        if stats is not None:
+            start = time.time()
+
+        vertices, segments = _turtle3d(self.lsystem().compact_state(), self.length, self.angle, stats)
+        self._box = _bounding_box_3d(vertices)
+        vertices[:, 0] += self.origin[0] - self._box[0]
+        vertices[:, 1] += self.origin[1]
+        self.meshes.append((vertices, segments))
+
+        if stats is not None:
+            stats.add('interpretation', time.time() - start)
+        return self
+
+    def bounding_box(self):
+        """
+        Returns:
+            (xmin, xmax, ymin, ymax, zmin, zmax) of the draws
+        """
+        return _bounding_box_3d(self.mesh()[0])
+
+    def mesh(self):
+        """
+        Returns:
+            (vertices, segments) of the draws
+            vertices: float array of shape (n, 3)
+            segments: int array of shape (m, 2) of vertex indexes
+        """
+        import numpy
+
+        if not self.meshes:
+            return numpy.zeros((0, 3)), numpy.zeros((0, 2), dtype=numpy.int64)
+        offset = 0
+        segments = []
+        for v, s in self.meshes:
+            segments.append(s + offset)
+            offset += len(v)
+        return (numpy.concatenate([v for v, s in self.meshes]),
+                numpy.concatenate(segments))
+
+    def tubes(self):
+        """
+        Returns:
+            (vertices, faces) of the tubes of the segments
+            vertices: float array of shape (n, 3)
+            faces: int array of shape (m, 4) of vertex indexes
+        """
+        vertices, segments = self.mesh()
+        return _tubes(vertices, segments, self.radius or 1, self.sides)
+
+    def obj(self, f):
+        """
+        write the mesh in the Wavefront OBJ format in the file f
+
+        Returns:
+            self
+        """
+        import numpy
+
+        stats = self.stats
+        if stats is not None:
+            start = time.time()
+
+        if self.radius:
+            vertices, elements = self.tubes()
+            prefix = 'f'
+        else:
+            vertices, elements = self.mesh()
+            prefix = 'l'
+        numpy.savetxt(f, vertices, fmt='v %.9g %.9g %.9g')
+        if len(elements):
+            numpy.savetxt(f, elements + 1, fmt=prefix + ' %d' * elements.shape[1])
+
+        if stats is not None:
+            stats.add('backend', time.time() - start)
+        return self
+
+    def ply(self, f):
+        """
+        write the mesh in the binary PLY format in the file f: edges for
+        the lines or faces for the tubes
+
+        Returns:
+            self
+
+        >>> import StringIO
+        >>> p = PlotD0L3D(lsystem=D0Lsystem('F', {'F': 'F'})).draw()
+        >>> f = StringIO.StringIO()
+        >>> p.ply(f) is p
+        True
+        >>> header, data = f.getvalue().split('end_header\\n')
+        >>> print header
+        ply
+        format binary_little_endian 1.0
+        element vertex 2
+        property float x
+        property float y
+        property float z
+        element edge 1
+        property int vertex1
+        property int vertex2
+        <BLANKLINE>
+        >>> len(data)
+        32
+        """
+        import numpy
+
+        stats = self.stats
+        if stats is not None:
+            start = time.time()
+
+        if self.radius:
+            vertices, faces = self.tubes()
+            elements = numpy.empty(len(faces), dtype=[('n', 'u1'), ('v', '<i4', 4)])
+            elements['n'] = 4
+            elements['v'] = faces
+            element = ['element face %d' % len(faces),
+                    'property list uchar int vertex_indices']
+        else:
+            vertices, segments = self.mesh()
+            elements = segments.astype('<i4')
+            element = ['element edge %d' % len(segments),
+                    'property int vertex1',
+                    'property int vertex2']
+        header = [
+            'ply',
+            'format binary_little_endian 1.0',
+            'element vertex %d' % len(vertices),
+            'property float x',
+            'property float y',
+            'property float z',
+        ] + element + ['end_header', '']
+        f.write('\n'.join(header))
+        f.write(vertices.astype('<f4').tostring())
+        f.write(elements.tostring())
+
+        if stats is not None:
+            stats.add('backend', time.time() - start)
+        return self
+
+    def nextdraw(self):
+        """
+        Prepare the next draw at the right of the current one
+
+        Returns:
+            self
+        """
+        xmin, xmax = self._box[:2]
+        self.origin[0] += 10 + xmax - xmin
+        return self
+
+    def reset(self):
+        """
+        Clear the mesh
+
+        Returns:
+            self
+        """
+        self.origin = [0, 0]
+        self._box = 0, 0, 0, 0, 0, 0
+        self.meshes = []
+        return self
+
+    def done(self):
+        """
+        write the mesh in filename, if any
+
+        Returns:
+            self
+        """
+        if self.filename is not None:
+            if self.filename.endswith('.obj'):
+                write = self.obj
+            elif self.filename.endswith('.ply'):
+                write = self.ply
+            else:
+                raise ValueError('filename must end with .obj or .ply')
+            f = open(self.filename, 'wb')
+            try:
+                write(f)
+            finally:
+                f.close()
+        return self
+
+def _bounding_box_3d(vertices):
+    """
+    Returns:
+        (xmin, xmax, ymin, ymax, zmin, zmax) of an array of vertices,
+        0 for no vertices
+    """
+    if not len(vertices):
+        return 0, 0, 0, 0, 0, 0
+    low = vertices.min(axis=0)
+    high = vertices.max(axis=0)
+    return (float(low[0]), float(high[0]), float(low[1]), float(high[1]),
+            float(low[2]), float(high[2]))
+
+def _tubes(vertices, segments, radius, sides=6):
+    """
+    tubes around segments, without caps
+
+    Returns:
+        (vertices, faces)
+        vertices: float array (2 * sides * m, 3), a ring of <sides>
+            vertices at both ends of each segment
+        faces: int array (sides * m, 4) of the quads between the rings
+
+    >>> import numpy
+    >>> v, f = _tubes(numpy.array([[0., 0, 0], [0, 10, 0]]), numpy.array([[0, 1]]), 1, 4)
+    >>> (v.round(6) + 0.0).tolist()[:4]
+    [[0.0, 0.0, -1.0], [-1.0, 0.0, 0.0], [0.0, 0.0, 1.0], [1.0, 0.0, 0.0]]
+    >>> f.tolist()[0]
+    [0, 1, 5, 4]
+    """
+    import numpy
+
+    p0 = vertices[segments[:, 0]]
+    p1 = vertices[segments[:, 1]]
+    d = p1 - p0
+    norm = numpy.sqrt((d * d).sum(axis=1))
+    norm[norm == 0] = 1
+    d /= norm[:, None]
+    # u, v: unit vectors orthogonal to the segment, from an axis which
+    # is not parallel to it
+    axis = numpy.zeros_like(d)
+    x = numpy.abs(d[:, 0]) < 0.9
+    axis[x, 0] = 1
+    axis[~x, 1] = 1
+    u = numpy.cross(d, axis)
+    u /= numpy.sqrt((u * u).sum(axis=1))[:, None]
+    v = numpy.cross(d, u)
+
+    theta = numpy.arange(sides) * (2 * math.pi / sides)
+    ring = radius * (numpy.cos(theta)[None, :, None] * u[:, None, :] +
+            numpy.sin(theta)[None, :, None] * v[:, None, :])
+    tubes = numpy.concatenate((p0[:, None, :] + ring, p1[:, None, :] + ring), axis=1).reshape(-1, 3)
+
+    i = numpy.arange(sides)
+    j = (i + 1) % sides
+    quad = numpy.column_stack((i, j, j + sides, i + sides))
+    faces = (numpy.arange(len(segments)) * 2 * sides)[:, None, None] + quad[None]
+    return tubes, faces.reshape(-1, 4)
+
+# rotations of the 3D symbols: axis in world coordinates of the initial
+# frame, where the heading H is +y, L is -x and U is +z, and sign; `+`
+# is a right turn like in the 2D interpreters. Composed on the right of
+# the frame, they turn around the current U, L and H.
+_TURNS_3D = {
+    '+': ((0, 0, 1), -1),
+    '-': ((0, 0, 1), 1),
+    '&': ((-1, 0, 0), 1),
+    '^': ((-1, 0, 0), -1),
+    '\\': ((0, 1, 0), 1),
+    '/': ((0, 1, 0), -1),
+}
+
+def _quaternions_3d(angle):
+    """
+    Returns:
+        float array (256, 4): quaternion (w, x, y, z) of the rotation of
+        each symbol code, the identity for the other symbols
+    """
+    import numpy
+
+    table = numpy.zeros((256, 4))
+    table[:, 0] = 1
+    half = math.radians(angle) / 2
+    for c, (axis, sign) in _TURNS_3D.items():
+        table[ord(c)] = [math.cos(half)] + [sign * math.sin(half) * a for a in axis]
+    # turn around U
+    table[ord('|')] = 0, 0, 0, 1
+    return table
+
+def _qmul(a, b):
+    """
+    Hamilton product of arrays of quaternions (w, x, y, z)
+    """
+    import numpy
+
+    w1, x1, y1, z1 = a[:, 0], a[:, 1], a[:, 2], a[:, 3]
+    w2, x2, y2, z2 = b[:, 0], b[:, 1], b[:, 2], b[:, 3]
+    return numpy.column_stack((
+        w1 * w2 - x1 * x2 - y1 * y2 - z1 * z2,
+        w1 * x2 + x1 * w2 + y1 * z2 - z1 * y2,
+        w1 * y2 - x1 * z2 + y1 * w2 + z1 * x2,
+        w1 * z2 + x1 * y2 - y1 * x2 + z1 * w2))
+
+def _turtle3d(state, length=10, angle=90, stats=None):
+    """
+    3D interpretation of a D0L string with branch, with NumPy
+
+    A run of `F` is a single segment. The frame of the turtle after a
+    symbol is the product of the rotations since the start of its
+    branch, composed with the frame at the `[` opening the branch. The
+    symbols are sorted by branch, the products in every branch are
+    computed at once with a segmented scan of quaternions (log2 of the
+    longest branch passes on arrays) and the frames of the branches are
+    composed level by level. The positions are the same with cumulative
+    sums of moves.
+
+    Args:
+        state: string for current state, or list of runs (symbol, count)
+        length: length of a line
+        angle: rotation angle in degree
+        stats: Stats instance counting symbols, segments and max_stack_depth
+
+    Returns:
+        (vertices, segments)
+        vertices: float array (n + 1, 3), the root then the end of
+            each segment
+        segments: int array (n, 2) of vertex indexes, in the order of
+            the state
+
+    >>> vertices, segments = _turtle3d('F+F')
+    >>> vertices.tolist(), segments.tolist()
+    ([[0.0, 0.0, 0.0], [0.0, 10.0, 0.0], [10.0, 10.0, 0.0]], [[0, 1], [1, 2]])
+    >>> vertices, segments = _turtle3d('FF[&F]/[&F]\\\\F')
+    >>> vertices.tolist()
+    [[0.0, 0.0, 0.0], [0.0, 20.0, 0.0], [0.0, 20.0, -10.0], [10.0, 20.0, 0.0], [0.0, 30.0, 0.0]]
+    >>> segments.tolist()
+    [[0, 1], [1, 2], [1, 3], [1, 4]]
+    >>> _turtle3d('F]')
+    Traceback (most recent call last):
+        ...
+    ValueError: inconsistant state: using to much `]`
+    """
+    import numpy
+
+    if not isinstance(state, basestring):
+        state = ''.join(c * k for c, k in state)
+    codes = numpy.frombuffer(state, dtype=numpy.uint8)
+    n = len(codes)
+
+    # keep the first `F` of each run with the length of the run, and
+    # the symbols of the interpretation
+    is_f = codes == ord('F')
+    run = is_f.copy()
+    run[1:] &= ~is_f[:-1]
+    ends = numpy.flatnonzero(is_f & ~numpy.append(is_f[1:], False))
+    moves = (ends - numpy.flatnonzero(run) + 1) * float(length)
+    keep = numpy.zeros(256, dtype=bool)
+    keep[[ord(c) for c in '[]|' + ''.join(_TURNS_3D)]] = True
+    keep = run | keep[codes]
+    codes = codes[keep]
+    m = len(codes)
+    if not m:
+        if stats is not None:
+            stats.count('symbols', n)
+        return numpy.zeros((1, 3)), numpy.zeros((0, 2), dtype=numpy.int64)
+
+    is_f = codes == ord('F')
+    opens = codes == ord('[')
+    closes = codes == ord(']')
+    # depth after each symbol
+    depth = numpy.cumsum(opens.astype(numpy.int64) - closes)
+    if depth.min() < 0:
+        raise ValueError('inconsistant state: using to much `]`')
+    # `[` and `]` belong to the enclosing branch
+    level = depth - opens
+
+    # sort the symbols by level then position: every branch is a slice,
+    # its parent is the last `[` of the level before it
+    index = numpy.arange(m)
+    open_index = index[opens]
+    order = numpy.lexsort((numpy.concatenate((index, open_index)),
+            numpy.concatenate((level, depth[opens]))))
+    is_symbol = order < m
+    last_open = numpy.maximum.accumulate(numpy.where(is_symbol, -1, numpy.arange(len(order))))
+    parent = numpy.where(last_open >= 0, order[last_open] - m, -1)[is_symbol]
+    parent[parent >= 0] = open_index[parent[parent >= 0]]
+    order = order[is_symbol]
+    level = level[order]
+    sorted_index = numpy.empty(m, dtype=numpy.int64)
+    sorted_index[order] = index
+    first = numpy.ones(m, dtype=bool)
+    first[1:] = parent[1:] != parent[:-1]
+    start = numpy.maximum.accumulate(numpy.where(first, index, 0))
+
+    # segmented scan of the rotations in each branch
+    table = _quaternions_3d(angle)
+    is_turn = table[codes[order], 0] != 1
+    turns = numpy.flatnonzero(is_turn)
+    q = table[codes[order[turns]]]
+    branch = start[turns]
+    k = 1
+    while k < len(turns):
+        j = numpy.flatnonzero(branch[k:] == branch[:-k]) + k
+        if not len(j):
+            break
+        q[j] = _qmul(q[j - k], q[j])
+        k *= 2
+    q /= numpy.sqrt((q * q).sum(axis=1))[:, None]
+    # frame in the branch: product of its rotations up to each symbol
+    frame = numpy.zeros((m, 4))
+    frame[:, 0] = 1
+    last = numpy.maximum.accumulate(numpy.where(is_turn, numpy.cumsum(is_turn) - 1, -1))
+    if len(turns):
+        last[(last >= 0) & (turns[last] < start)] = -1
+    frame[last >= 0] = q[last[last >= 0]]
+
+    # vertex of each `F` in the order of the state, and last `F` of the
+    # branch before each symbol
+    sorted_f = is_f[order]
+    vertex = numpy.zeros(m, dtype=numpy.int64)
+    vertex[sorted_index[is_f]] = numpy.arange(1, is_f.sum() + 1)
+    previous = numpy.concatenate(([-1], numpy.maximum.accumulate(numpy.where(sorted_f, index, -1))[:-1]))
+    previous = numpy.where(previous >= start, vertex[previous], -1)
+    moves_sorted = numpy.zeros(m)
+    moves_sorted[sorted_index[is_f]] = moves
+
+    # compose the branches with the frame, position and last vertex of
+    # their `[`, level by level; only the `F` and `[` are needed
+    position = numpy.zeros((m, 3))
+    needed = numpy.flatnonzero(sorted_f | (codes[order] == ord('[')))
+    levels = level[needed]
+    bounds = numpy.searchsorted(levels, numpy.arange(levels[-1] + 2 if len(needed) else 0))
+    for l in xrange(len(bounds) - 1):
+        s = needed[bounds[l]:bounds[l + 1]]
+        if not len(s):
+            continue
+        if l:
+            p = sorted_index[parent[s]]
+            frame[s] = _qmul(frame[p], frame[s])
+            base_position = position[p]
+            base_vertex = previous[p]
+        else:
+            base_position = 0
+            base_vertex = 0
+        previous[s] = numpy.where(previous[s] >= 0, previous[s], base_vertex)
+        # move of the `F`: heading, rotation of (0, 1, 0) by the frame
+        w, x, y, z = frame[s].T
+        move = numpy.column_stack((2 * (x * y - w * z), 1 - 2 * (x * x + z * z), 2 * (y * z + w * x)))
+        move *= moves_sorted[s][:, None]
+        # cumulative moves since the start of the branch
+        cum = numpy.cumsum(move, axis=0)
+        begin = numpy.searchsorted(s, start[s])
+        cum[begin > 0] -= cum[begin[begin > 0] - 1]
+        position[s] = base_position + cum
+
+    fs = sorted_index[is_f]
+    vertices = numpy.zeros((len(fs) + 1, 3))
+    vertices[1:] = position[fs]
+    # remove the rounding errors of the products, and -0
+    vertices.round(9, out=vertices)
+    vertices += 0.0
+    segments = numpy.column_stack((previous[fs], vertex[fs]))
+
+    if stats is not None:
+        stats.count('symbols', n)
+        stats.count('segments', len(segments))
+        stats.maximum('max_stack_depth', int(depth.max()))
+    return vertices, segments
+
+
+class PlotD0LMatplotlib(Plot):
+    """
+    Draw a D0Lsystem in a matplotlib Axes, a LineCollection by draw
+
+    The segments are interpreted with NumPy (see Geometry), with a color
+    and a width by segment chosen by the depth of its branch or the
+    generation of the draw. The LineCollection does not have a path by
+    segment, which is too slow for millions of them, but a path by
+    style of up to <chunk> segments separated by NaN: each path holds
+    several segments, and get_segments() of matplotlib 2, which drops
+    the NaN, joins them in one polyline. The segments themselves, from
+    the origin of the draw, are given by Plot.geometry().
+
+    >>> l = D0Lsystem('F', {'F': 'F[+F]F'})
+    >>> p = PlotD0LMatplotlib(lsystem=l, colors=['black', 'green'], widths=[2, 1])
+    >>> p.draw().nextdraw().step().draw() is p
+    True
+    >>> [len(c.get_paths()) for c in p.ax.collections]
+    [1, 2]
+    >>> p.ax.collections[1].get_paths()[0].vertices.tolist()
+    [[10.0, 0.0], [10.0, 10.0], [nan, nan], [10.0, 10.0], [10.0, 20.0], [nan, nan]]
+    >>> p.geometry().coords.tolist()
+    [[0.0, 0.0, 0.0, 10.0], [0.0, 10.0, 10.0, 10.0], [0.0, 10.0, 0.0, 20.0]]
+    >>> p.ax.collections[1].get_colors()[:, 1].tolist(), list(p.ax.collections[1].get_linewidths())
+    ([0.0, 0.5019607843137255], [2.0, 1.0])
+
+    a state without `F` draws an empty collection
+
+    >>> p = PlotD0LMatplotlib(lsystem=D0Lsystem('X', {'X': 'X+'})).step(2).draw()
+    >>> [len(c.get_paths()) for c in p.ax.collections]
+    [0]
+    """
+    # maximum number of segments of a path, the Agg renderer fails with
+    # too big paths
+    chunk = 10000
+
+    def __init__(self, length=10, angle=90, colors=None, lsystem=None, stats=None, filename=None, ax=None,
+            widths=None, color_by='depth', width_by='depth'):
+        """
+        Args:
+            colors: list of matplotlib colors, by depth or generation
+            filename: the figure is saved in filename by done()
+            ax: matplotlib Axes to draw in, None for a new Figure
+                without screen
+            widths: list of line widths, by depth or generation
+            color_by, width_by: 'depth' or 'generation', what chooses
+                the color and the width of a segment
+        """
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+        for by in color_by, width_by:
+            if by not in ('depth', 'generation'):
+                raise ValueError("color_by and width_by must be 'depth' or 'generation'")
+        self.length = length
+        self.angle = angle
+        if colors is None:
+            self.colors = ['red', 'green', 'blue', 'orange', 'yellow', 'brown']
+        else:
+            self.colors = colors
+        if widths is None:
+            self.widths = [1]
+        else:
+            self.widths = widths
+        self.color_by = color_by
+        self.width_by = width_by
+        self.stats = stats
+        self.filename = filename
+        if ax is None:
+            figure = Figure()
+            FigureCanvasAgg(figure)
+            ax = figure.add_subplot(1, 1, 1)
+            ax.set_aspect('equal')
+        self.ax = ax
+
+        # draw number
+        self.ith_draw = 0
+        # origin of next draw
+        self.origin = [0, 0]
+        # bounding box of the last draw
+        self._box = 0, 0, 0, 0
+        # LineCollection of the draws
+        self.collections = []
+
+        if lsystem is not None:
+            self.lsystem(lsystem)
+
+    def draw(self):
+        """
+        draw process
+        - interpret the current state in segments
+        - add their LineCollection at the right of the previous draws
+
+        Returns:
+            self
+        """
+        import numpy
+        from matplotlib.collections import LineCollection
+        from matplotlib.colors import to_rgba_array
+
+        geometry = self.geometry()
+        stats = self.stats
+        if stats is not None:
+            start = time.time()
+
+        coords = geometry.coords
+        if len(coords):
+            # the root is in the box, like in _bounding_box
+            self._box = _bounding_box_int(
+                    min(0.0, coords[:, 0::2].min()), max(0.0, coords[:, 0::2].max()),
+                    min(0.0, coords[:, 1::2].min()), max(0.0, coords[:, 1::2].max()))
+        else:
+            self._box = 0, 0, 0, 0
+        # translate draw in positive x from origin
+        coords[:, 0::2] += self.origin[0] - self._box[0]
+        coords[:, 1::2] += self.origin[1]
+
+        # style of each segment: index of its color and width
+        generation = self.lsystem().generation
+        def choose(count, by):
+            if by == 'depth':
+                return geometry.depth % count
+            return numpy.full(len(coords), generation % count, dtype=numpy.int64)
+        styles = (choose(len(self.colors), self.color_by) * len(self.widths) +
+                choose(len(self.widths), self.width_by))
+        order = numpy.argsort(styles, kind='mergesort')
+        styles = styles[order]
+
+        # vertices of the segments by style: start, end and NaN to move
+        vertices = numpy.empty((len(coords), 3, 2))
+        vertices[:, 0] = coords[order, :2]
+        vertices[:, 1] = coords[order, 2:]
+        vertices[:, 2] = numpy.nan
+        vertices = vertices.reshape(-1, 2)
+        # a path by style and chunk
+        starts = numpy.flatnonzero(numpy.diff(styles)) + 1
+        starts = numpy.union1d(numpy.append(starts, 0), numpy.arange(0, len(coords), self.chunk))
+        # no path without segment: the collection of the draw is empty
+        starts = starts[starts < len(coords)]
+        stops = numpy.append(starts[1:], len(coords))
+        colors = to_rgba_array(self.colors)[styles[starts] // len(self.widths)]
+        widths = numpy.asarray(self.widths, dtype=float)[styles[starts] % len(self.widths)]
+        paths = [vertices[3 * i:3 * j] for i, j in zip(starts, stops)]
+
+        collection = LineCollection(paths, colors=colors, linewidths=widths)
+        self.ax.add_collection(collection)
+        self.ax.autoscale_view()
+        self.collections.append(collection)
+
+        if stats is not None:
+            stats.add('backend', time.time() - start)
+        return self
+
+    def nextdraw(self):
+        """
+        Prepare the next draw at the right of the current one
+
+        Returns:
+            self
+        """
+        xmin, xmax, ymin, ymax = self._box
+        self.origin[0] += 10 + xmax - xmin
+        self.ith_draw += 1
+        return self
+
+    def reset(self):
+        """
+        Remove the draws from the Axes
+
+        Returns:
+            self
+        """
+        for collection in self.collections:
+            collection.remove()
+        self.collections = []
+        self.ith_draw = 0
+        self.origin = [0, 0]
+        self._box = 0, 0, 0, 0
+        return self
+
+    def done(self):
+        """
+        save the figure in filename, if any
+
+        Returns:
+            self
+        """
+        if self.filename is not None:
+            self.ax.figure.savefig(self.filename)
+        return self
+
 
 
 
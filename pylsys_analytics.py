@@ -0,0 +1,391 @@
+#! /usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""
+fractal dimension, coverage and density of the segments of L-systems
+
+The segments are hashed with NumPy in grids of several scales (sizes of
+the cells), aligned on 0, 0:
+
+- counts: number of cells touched by the segments at each scale
+- dimension: box-counting dimension, the slope of log(count) against
+  log(1 / scale)
+- coverage: part of the cells of the bounding box touched at each scale
+- density: number of segments by cell, from their middle, for the
+  cells with segments only; the grid of the whole bounding box, mostly
+  empty cells, is printed with --dense
+
+The segments come from the Geometry of a state, or with --stream from
+the Geometry of its parts, so the geometry of a huge state is never
+held, only the cells touched; both give the same segments.
+
+Jobs are read from a JSON Lines file like the jobs of pylsys_batch, and
+a JSON line of analytics is printed by job:
+
+    python pylsys_analytics.py jobs.jsonl --scales 10 20 40 80 --stream
+
+masterzu, 2014
+"""
+
+import sys
+import json
+import math
+
+import numpy
+
+from pylsys import _geometries
+from pylsys_batch import read_jobs, job_plot
+
+# number of scales by default: length, 2 * length, 4 * length ...
+LEVELS = 8
+# number of symbols of a part of the state in stream mode
+PART = 65536
+
+
+def default_scales(length, levels=LEVELS):
+    """
+    Returns:
+        the scales length * 2 ** k, k from 0 to levels - 1
+
+    >>> default_scales(10, 3)
+    [10.0, 20.0, 40.0]
+    """
+    return [float(length) * 2 ** k for k in xrange(levels)]
+
+
+def _keys(ix, iy):
+    """
+    Returns:
+        int64 hash of the cells ix, iy
+    """
+    return ix.astype(numpy.int64) * (1 << 32) + (iy.astype(numpy.int64) + (1 << 31))
+
+
+def _cells(coords, scale):
+    """
+    cells of size scale touched by the segments: the cells of both ends
+    and the cells on both sides of each crossing with a line of the grid
+
+    Args:
+        coords: float array (n, 4) of x0, y0, x1, y1
+
+    Returns:
+        sorted int64 array of the hashes of the cells
+
+    >>> len(_cells(numpy.array([[0.5, 0.5, 2.5, 0.5]]), 1))
+    3
+    >>> len(_cells(numpy.array([[0.5, 0.2, 1.5, 0.8], [0.5, 0.5, 0.6, 0.6]]), 1))
+    2
+    >>> len(_cells(numpy.array([[0.5, 0.5, 1.5, 1.5]]), 1))
+    4
+    """
+    x0, y0, x1, y1 = coords[:, 0], coords[:, 1], coords[:, 2], coords[:, 3]
+    ix0 = numpy.floor(x0 / scale).astype(numpy.int64)
+    iy0 = numpy.floor(y0 / scale).astype(numpy.int64)
+    ix1 = numpy.floor(x1 / scale).astype(numpy.int64)
+    iy1 = numpy.floor(y1 / scale).astype(numpy.int64)
+    keys = [_keys(ix0, iy0), _keys(ix1, iy1)]
+
+    for a0, b0, a1, b1, ia0, ia1, vertical in ((x0, y0, x1, y1, ix0, ix1, True),
+            (y0, x0, y1, x1, iy0, iy1, False)):
+        # crossings of the lines a = m * scale, for m in ]min(ia), max(ia)]
+        low = numpy.minimum(ia0, ia1)
+        counts = numpy.abs(ia1 - ia0)
+        segments = numpy.repeat(numpy.arange(len(coords)), counts)
+        m = (numpy.repeat(low, counts) + 1 +
+                numpy.arange(len(segments)) - numpy.repeat(numpy.cumsum(counts) - counts, counts))
+        a0s = a0[segments]
+        b0s = b0[segments]
+        b = b0s + (m * scale - a0s) * (b1[segments] - b0s) / (a1[segments] - a0s)
+        ib = numpy.floor(b / scale).astype(numpy.int64)
+        for side in m - 1, m:
+            keys.append(_keys(side, ib) if vertical else _keys(ib, side))
+    return numpy.unique(numpy.concatenate(keys))
+
+
+class _Union:
+    """
+    union of sorted arrays of keys added by batches, merged when the
+    pending keys are more than the merged ones
+    """
+    def __init__(self):
+        self.keys = numpy.zeros(0, dtype=numpy.int64)
+        self.pending = []
+        self.size = 0
+
+    def add(self, keys):
+        self.pending.append(keys)
+        self.size += len(keys)
+        if self.size > len(self.keys):
+            self.merge()
+
+    def merge(self):
+        if self.pending:
+            self.keys = numpy.unique(numpy.concatenate([self.keys] + self.pending))
+            self.pending = []
+            self.size = 0
+        return self.keys
+
+
+class Analytics:
+    """
+    Cells touched by segments at several scales, added by batches
+
+    >>> a = Analytics([1, 2, 4], cell=2)
+    >>> a.add(numpy.array([[0, 0, 0, 8], [0, 8, 8, 8]], dtype=float)) is a
+    True
+    >>> a.counts()
+    [17, 9, 5]
+    >>> a.coverage()
+    [0.20987654320987653, 0.36, 0.5555555555555556]
+    >>> round(a.dimension(), 3)
+    0.883
+    >>> cells, density = a.density()
+    >>> cells.tolist(), density.tolist()
+    ([[0, 2], [2, 4]], [1, 1])
+    >>> origin, grid = a.density_grid()
+    >>> origin
+    (0.0, 4.0)
+    >>> grid.tolist()
+    [[1, 0, 0], [0, 0, 0], [0, 0, 1]]
+    """
+
+    def __init__(self, scales, cell=None):
+        """
+        Args:
+            scales: sizes of the cells of the counts and coverage
+            cell: size of the cells of the density, None for the
+                smallest scale
+        """
+        self.scales = [float(s) for s in scales]
+        if not self.scales or min(self.scales) <= 0:
+            raise ValueError('scales must be positive')
+        if cell is None:
+            cell = min(self.scales)
+        self.cell = float(cell)
+        self.segments = 0
+        # bounding box of the segments
+        self.box = None
+        self._cells = [_Union() for s in self.scales]
+        # cells of the middles of the segments and their number of
+        # segments: merged ones first, and pending ones of the batches
+        self._density = [numpy.zeros(0, dtype=numpy.int64)], [numpy.zeros(0, dtype=numpy.int64)]
+        self._pending = 0
+
+    def add(self, coords):
+        """
+        add a batch of segments
+
+        Args:
+            coords: float array (n, 4) of x0, y0, x1, y1
+
+        Returns:
+            self
+        """
+        coords = numpy.asarray(coords, dtype=float).reshape(-1, 4)
+        if not len(coords):
+            return self
+        self.segments += len(coords)
+        xs = coords[:, 0::2]
+        ys = coords[:, 1::2]
+        box = xs.min(), xs.max(), ys.min(), ys.max()
+        if self.box is None:
+            self.box = box
+        else:
+            self.box = (min(self.box[0], box[0]), max(self.box[1], box[1]),
+                    min(self.box[2], box[2]), max(self.box[3], box[3]))
+
+        for scale, cells in zip(self.scales, self._cells):
+            cells.add(_cells(coords, scale))
+
+        ix = numpy.floor((coords[:, 0] + coords[:, 2]) / (2 * self.cell)).astype(numpy.int64)
+        iy = numpy.floor((coords[:, 1] + coords[:, 3]) / (2 * self.cell)).astype(numpy.int64)
+        keys, counts = numpy.unique(_keys(ix, iy), return_counts=True)
+        self._density[0].append(keys)
+        self._density[1].append(counts)
+        self._pending += len(keys)
+        if self._pending > len(self._density[0][0]):
+            self._merge_density()
+        return self
+
+    def _merge_density(self):
+        """
+        Returns:
+            (keys, counts) of the cells of the density
+        """
+        keys, inverse = numpy.unique(numpy.concatenate(self._density[0]), return_inverse=True)
+        counts = numpy.bincount(inverse, weights=numpy.concatenate(self._density[1])).astype(numpy.int64)
+        self._density = [keys], [counts]
+        self._pending = 0
+        return keys, counts
+
+    def counts(self):
+        """
+        Returns:
+            list of the number of cells touched at each scale
+        """
+        return [len(cells.merge()) for cells in self._cells]
+
+    def coverage(self):
+        """
+        Returns:
+            list of the part of the cells of the bounding box touched at
+            each scale
+        """
+        if self.box is None:
+            return [0.0 for s in self.scales]
+        xmin, xmax, ymin, ymax = self.box
+        coverage = []
+        for scale, count in zip(self.scales, self.counts()):
+            columns = math.floor(xmax / scale) - math.floor(xmin / scale) + 1
+            rows = math.floor(ymax / scale) - math.floor(ymin / scale) + 1
+            coverage.append(count / (columns * rows))
+        return coverage
+
+    def dimension(self):
+        """
+        Returns:
+            box-counting dimension: slope of the least squares line of
+            log(count) against log(1 / scale), None with less than two
+            scales
+        """
+        if len(self.scales) < 2 or self.box is None:
+            return None
+        x = -numpy.log(self.scales)
+        y = numpy.log(self.counts())
+        return float(numpy.polyfit(x, y, 1)[0])
+
+    def density(self):
+        """
+        Returns:
+            (cells, counts): int array (n, 2) of the indexes ix, iy of
+            the cells with segments, sorted, the cell ix, iy starting at
+            ix * cell, iy * cell, and int array (n) of the number of
+            segments with their middle in each cell
+        """
+        keys, counts = self._merge_density()
+        cells = numpy.empty((len(keys), 2), dtype=numpy.int64)
+        cells[:, 0] = keys >> 32
+        cells[:, 1] = (keys & 0xffffffff) - (1 << 31)
+        return cells, counts
+
+    def density_grid(self):
+        """
+        density on the grid of the bounding box, mostly empty cells for
+        a big state
+
+        Returns:
+            ((x, y), counts): origin of the cell counts[0, 0] and int
+            array (rows, columns) of the number of segments with their
+            middle in each cell, rows by y
+        """
+        if self.box is None:
+            return (0.0, 0.0), numpy.zeros((0, 0), dtype=numpy.int64)
+        cells, counts = self.density()
+        ix = cells[:, 0]
+        iy = cells[:, 1]
+        x0 = ix.min()
+        y0 = iy.min()
+        density = numpy.zeros((iy.max() - y0 + 1, ix.max() - x0 + 1), dtype=numpy.int64)
+        density[iy - y0, ix - x0] = counts
+        return (x0 * self.cell, y0 * self.cell), density
+
+    def as_dict(self, dense=False):
+        """
+        Args:
+            dense: give the density on the grid of the bounding box,
+                see density_grid, instead of by cell with segments
+
+        Returns:
+            dict of the scales, counts, coverage, dimension and the
+            density as lists
+        """
+        if dense:
+            origin, grid = self.density_grid()
+            density = {'origin': origin, 'counts': grid.tolist()}
+        else:
+            cells, counts = self.density()
+            density = {'cells': cells.tolist(), 'counts': counts.tolist()}
+        density['cell'] = self.cell
+        return {
+            'segments': self.segments,
+            'scales': self.scales,
+            'counts': self.counts(),
+            'coverage': self.coverage(),
+            'dimension': self.dimension(),
+            'density': density,
+        }
+
+
+def analyze(plot, scales=None, cell=None, stream=False):
+    """
+    Analytics of the current state of a plot
+
+    Args:
+        plot: Plot with a lsystem, a length and an angle
+        scales: scales of the counts, None for default_scales(length)
+        cell: size of the cells of the density
+        stream: interpret the state by parts, see pylsys._geometries
+
+    Returns:
+        the Analytics
+
+    >>> from pylsys import D0Lsystem, PlotD0LSvg
+    >>> p = PlotD0LSvg(angle=60, lsystem=D0Lsystem('F', {'F': 'F+F--F+F'})).step(5)
+    >>> a = analyze(p, default_scales(10, 6))
+    >>> round(a.dimension(), 1)
+    1.2
+    >>> p = PlotD0LSvg(angle=25.7, lsystem=D0Lsystem('F', {'F': 'F[+F]F[-F]F'})).step(5)
+    >>> a = analyze(p, default_scales(1, 6))
+    >>> b = analyze(p, default_scales(1, 6), stream=True)
+    >>> b.counts() == a.counts(), b.as_dict() == a.as_dict()
+    (True, True)
+    """
+    if scales is None:
+        scales = default_scales(plot.length)
+    analytics = Analytics(scales, cell)
+    if stream:
+        for geometry in _geometries(plot.lsystem().compact_state(), plot.length, plot.angle, PART):
+            analytics.add(geometry.coords)
+    else:
+        analytics.add(plot.geometry().coords)
+    return analytics
+
+
+def main(argv=None):
+    """
+    command line entry point
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(description='fractal dimension, coverage and density of L-system jobs')
+    parser.add_argument('jobs', help='JSON Lines file of jobs, - for stdin')
+    parser.add_argument('--scales', type=float, nargs='+',
+            help='sizes of the cells (default: length times 1, 2, 4 ... %d)' % 2 ** (LEVELS - 1))
+    parser.add_argument('--cell', type=float, help='size of the cells of the density (default: smallest scale)')
+    parser.add_argument('--stream', action='store_true',
+            help='interpret the states by parts, without holding the geometry')
+    parser.add_argument('--dense', action='store_true',
+            help='print the density on the grid of the bounding box, not by cell with segments')
+    args = parser.parse_args(argv)
+
+    if args.jobs == '-':
+        jobs = list(read_jobs(sys.stdin))
+    else:
+        f = open(args.jobs)
+        try:
+            jobs = list(read_jobs(f))
+        finally:
+            f.close()
+
+    for job in jobs:
+        plot = job_plot(dict(job, output=None))
+        result = analyze(plot, args.scales, args.cell, args.stream).as_dict(args.dense)
+        result['id'] = job['id']
+        sys.stdout.write(json.dumps(result, sort_keys=True) + '\n')
+        sys.stdout.flush()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
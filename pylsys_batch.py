@@ -0,0 +1,260 @@
+#! /usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""
+render many L-systems in parallel, without graphic display
+
+Jobs are read from a JSON Lines file, one job by line:
+
+    {"id": "koch-3", "axiom": "F", "rules": {"F": "F+F--F+F"},
+     "angle": 60, "length": 10, "generation": 3, "output": "koch-3.svg"}
+
+`id` is optional (the line number is used), `angle`, `length` and
+`generation` default to 90, 10 and 0. With `"instances": true` the SVG
+defines each repeated shape once (see PlotD0LSvg): the state is not
+derived, and the result has the number of shapes `instances` instead of
+`symbols` and `segments`.
+
+Every job is rendered in SVG by a pool of processes. A JSON line is
+printed on stdout as soon as a job is finished:
+
+    {"id": "koch-3", "status": "ok", "output": "koch-3.svg",
+     "symbols": 85, "segments": 64, "time": {...}}
+
+With --log, results are also appended to a file, and with --resume the
+jobs already done with status "ok" in this file are skipped, so an
+interrupted batch can be restarted.
+
+Usage:
+
+    python pylsys_batch.py jobs.jsonl -j 8 --log results.jsonl --resume
+
+masterzu, 2014
+"""
+
+import sys
+import time
+import json
+import multiprocessing
+
+from pylsys import D0Lsystem, PlotD0LSvg, Stats
+
+
+def read_jobs(lines):
+    """
+    Generator of the jobs of JSON lines, blank lines are ignored
+
+    >>> jobs = list(read_jobs(['{"axiom": "F", "rules": {"F": "FF"}}', '',
+    ...     '{"id": "a", "axiom": "X", "rules": {"X": "F"}}']))
+    >>> [j['id'] for j in jobs]
+    ['1', 'a']
+    >>> list(read_jobs(['{"rules": {"F": "FF"}}']))
+    Traceback (most recent call last):
+        ...
+    ValueError: line 1: job must have an axiom and rules
+    """
+    for i, line in enumerate(lines):
+        line = line.strip()
+        if not line:
+            continue
+        job = json.loads(line)
+        if 'axiom' not in job or 'rules' not in job:
+            raise ValueError('line %d: job must have an axiom and rules' % (i + 1))
+        job['id'] = str(job.get('id', i + 1))
+        yield job
+
+
+def completed_jobs(lines):
+    """
+    Returns:
+        the set of job ids with status "ok" in the result lines
+
+    >>> sorted(completed_jobs(['{"id": "1", "status": "ok"}',
+    ...     '{"id": "2", "status": "error"}', '{"id": "3", "st']))
+    [u'1']
+    """
+    done = set()
+    for line in lines:
+        try:
+            result = json.loads(line)
+        except ValueError:
+            # last line of an interrupted batch
+            continue
+        if result.get('status') == 'ok':
+            done.add(result['id'])
+    return done
+
+
+def _str(s):
+    """
+    utf-8 string of the unicode strings of json, Lsystem works with str
+    """
+    if isinstance(s, unicode):
+        return s.encode('utf-8')
+    return s
+
+
+def job_lsystem(job, stats=None):
+    """
+    Returns:
+        the D0Lsystem of a job, at generation 0
+
+    >>> job_lsystem({'axiom': u'F', 'rules': {u'F': u'F+F'}}).rules
+    {'F': 'F+F'}
+    """
+    rules = job['rules']
+    if isinstance(rules, dict):
+        rules = dict((_str(k), _str(v)) for k, v in rules.items())
+    return D0Lsystem(_str(job['axiom']), rules, stats=stats)
+
+
+def job_plot(job, stats=None):
+    """
+    Returns:
+        the PlotD0LSvg of a job, with its D0Lsystem at the generation
+        of the job, its state is not derived with instances
+
+    >>> p = job_plot({'axiom': 'F', 'rules': {u'F': u'F+F'}, 'generation': 1})
+    >>> p.lsystem().state(), p.angle
+    ('F+F', 90)
+    """
+    lsys = job_lsystem(job, stats)
+    plot = PlotD0LSvg(length=job.get('length', 10), angle=job.get('angle', 90),
+            lsystem=lsys, stats=stats, filename=job.get('output'),
+            instances=job.get('instances', False))
+    if plot.instances:
+        return plot.skip(job.get('generation', 0))
+    return plot.step(job.get('generation', 0))
+
+
+def render_job(job):
+    """
+    render a job in a SVG document
+
+    Returns:
+        dict of the result, with status 'ok' or 'error'
+
+    >>> r = render_job({'id': '1', 'axiom': 'F', 'rules': {'F': 'F+F'},
+    ...     'generation': 2})
+    >>> r['status'], r['symbols'], r['segments']
+    ('ok', 7, 4)
+    >>> sorted(r['time'].keys())
+    ['backend', 'bbox', 'interpretation', 'rewrite', 'total']
+    >>> r = render_job({'id': '2', 'axiom': u'F', 'rules': {u'F': u'FF'}})
+    >>> r['status'], r['symbols']
+    ('ok', 1)
+    >>> r = render_job({'id': '4', 'axiom': 'F', 'rules': {'F': 'F[+F]F'},
+    ...     'generation': 3, 'instances': True})
+    >>> r['status'], r['instances'], 'symbols' in r
+    ('ok', 3, False)
+    >>> r = render_job({'id': '3', 'axiom': 'F', 'rules': []})
+    >>> r['status'], r['error']
+    ('error', 'TypeError: rules must be a non empty dict')
+    """
+    start = time.time()
+    result = {'id': job['id'], 'output': job.get('output')}
+    try:
+        stats = Stats()
+        plot = job_plot(job, stats)
+        lsys = plot.lsystem()
+        plot.draw().done()
+    except Exception, e:
+        result['status'] = 'error'
+        result['error'] = '%s: %s' % (e.__class__.__name__, e)
+    else:
+        result['status'] = 'ok'
+        result['generation'] = lsys.generation
+        for name in 'symbols', 'segments', 'instances':
+            if name in stats.counters:
+                result[name] = stats.counters[name]
+        result['time'] = dict((name, p['time']) for name, p in stats.phases.items())
+    result.setdefault('time', {})['total'] = time.time() - start
+    return result
+
+
+def run(jobs, processes=None, log=None, out=sys.stdout):
+    """
+    render the jobs with a pool of processes and write a JSON line of
+    result in out, and in log if any, as soon as a job is finished
+
+    Returns:
+        the number of jobs in error
+    """
+    errors = 0
+    pool = multiprocessing.Pool(processes)
+    try:
+        for result in pool.imap_unordered(render_job, jobs):
+            line = json.dumps(result, sort_keys=True)
+            out.write(line + '\n')
+            out.flush()
+            if log is not None:
+                log.write(line + '\n')
+                log.flush()
+            if result['status'] != 'ok':
+                errors += 1
+        pool.close()
+    except KeyboardInterrupt:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    return errors
+
+
+def main(argv=None):
+    """
+    command line entry point
+
+    Returns:
+        exit status: 0 if all jobs are done, 1 otherwise
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(description='render L-system jobs of a JSON Lines file in SVG')
+    parser.add_argument('jobs', help='JSON Lines file of jobs, - for stdin')
+    parser.add_argument('-j', '--processes', type=int, default=None,
+            help='number of rendering processes (default: number of CPUs)')
+    parser.add_argument('--log', help='append the results to this JSON Lines file')
+    parser.add_argument('--resume', action='store_true',
+            help='skip the jobs already done in the --log file')
+    args = parser.parse_args(argv)
+
+    if args.resume and args.log is None:
+        parser.error('--resume needs --log')
+
+    done = set()
+    if args.resume:
+        try:
+            f = open(args.log)
+        except IOError:
+            pass
+        else:
+            try:
+                done = completed_jobs(f)
+            finally:
+                f.close()
+
+    if args.jobs == '-':
+        jobs = list(read_jobs(sys.stdin))
+    else:
+        f = open(args.jobs)
+        try:
+            jobs = list(read_jobs(f))
+        finally:
+            f.close()
+    jobs = [job for job in jobs if job['id'] not in done]
+
+    log = None
+    if args.log is not None:
+        log = open(args.log, 'a')
+    try:
+        errors = run(jobs, args.processes, log)
+    finally:
+        if log is not None:
+            log.close()
+
+    return errors and 1 or 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,472 @@
+#! /usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""
+HTTP server rendering L-systems in SVG
+
+POST /render with a JSON job, like the jobs of pylsys_batch:
+
+    {"axiom": "F", "rules": {"F": "F[+F]F[-F]F"}, "angle": 25.7,
+     "generation": 4, "size": [400, 600]}
+
+`angle`, `length` and `generation` default to 90, 10 and 0, `size` is
+the [width, height] of the image (default: the units of the draw). The
+answer is the SVG document, its X-Pylsys-Source header tells if it
+was 'rendered', 'coalesced' with an identical request in progress or
+read from the 'cache'. A bad job answers 400 with a JSON error, as a
+job over the limits of generation or number of symbols. A request
+without result after the timeout answers 504, its render goes on and
+the identical requests wait for it; a render without result after
+max_age is taken for lost and submitted again.
+
+GET /stats answers JSON counters: requests, rendered, coalesced,
+cache hits, errors, timeouts, lost renders, jobs in flight (submitted
+to the pool and not finished: its queue depth), cache items and the
+latency of the last requests.
+
+Each request is served by a thread waiting for a pool of processes,
+which rewrites and draws: the server is never blocked by a render.
+
+Usage:
+
+    python pylsys_server.py --port 8000 -j 4 --cache 256 --timeout 30
+
+masterzu, 2014
+"""
+
+import sys
+import time
+import json
+import threading
+import collections
+import multiprocessing
+import BaseHTTPServer
+import SocketServer
+
+from pylsys import Stats
+from pylsys_batch import job_plot, job_lsystem
+
+# number of requests in the latency statistics
+LATENCIES = 1000
+# seconds to wait for a render
+TIMEOUT = 60
+# seconds after which a render without result is lost: its process died
+MAX_AGE = 600
+# limits of the jobs: generation, and number of symbols of the state
+MAX_GENERATION = 64
+MAX_SYMBOLS = 10 ** 7
+
+
+def job_key(job):
+    """
+    Returns:
+        the key of a job: the JSON of its fields with their defaults, two
+        jobs with the same key render the same image
+
+    >>> job_key({'axiom': 'F', 'rules': {'F': 'FF'}}) == job_key({'axiom': 'F',
+    ...     'rules': {'F': 'FF'}, 'angle': 90, 'generation': 0, 'id': 'a'})
+    True
+    >>> job_key({'rules': {'F': 'FF'}})
+    Traceback (most recent call last):
+        ...
+    ValueError: job must have an axiom and rules
+    """
+    if not isinstance(job, dict) or 'axiom' not in job or 'rules' not in job:
+        raise ValueError('job must have an axiom and rules')
+    return json.dumps({
+        'axiom': job['axiom'],
+        'rules': job['rules'],
+        'angle': job.get('angle', 90),
+        'length': job.get('length', 10),
+        'generation': job.get('generation', 0),
+        'instances': job.get('instances', False),
+        'size': job.get('size'),
+    }, sort_keys=True)
+
+
+def check_job(job, max_generation=MAX_GENERATION, max_symbols=MAX_SYMBOLS):
+    """
+    raise ValueError if a job is over the limits: its number of symbols
+    is counted from the rules, the state is not derived; the states of
+    the jobs with instances are not derived at all
+
+    >>> check_job({'axiom': 'F', 'rules': {'F': 'FF'}, 'generation': 20})
+    >>> check_job({'axiom': 'F', 'rules': {'F': 'FF'}, 'generation': 30})
+    Traceback (most recent call last):
+        ...
+    ValueError: job of 1073741824 symbols, the limit is 10000000
+    >>> check_job({'axiom': 'F', 'rules': {'F': 'FF'}, 'generation': 100, 'instances': True})
+    Traceback (most recent call last):
+        ...
+    ValueError: generation must be an integer from 0 to 64
+    """
+    generation = job.get('generation', 0)
+    if not isinstance(generation, (int, long)) or not 0 <= generation <= max_generation:
+        raise ValueError('generation must be an integer from 0 to %d' % max_generation)
+    if job.get('instances', False):
+        return
+    try:
+        lsys = job_lsystem(job)
+        symbols = lsys._lengths(lsys.axiom, generation)[-1]
+    except TypeError:
+        # a bad job is answered by render_svg
+        return
+    if symbols > max_symbols:
+        raise ValueError('job of %d symbols, the limit is %d' % (symbols, max_symbols))
+
+
+def render_svg(job):
+    """
+    render a job in a SVG document, in a process of the pool
+
+    Returns:
+        dict of the result, with status 'ok' and the svg, or 'error'
+
+    >>> r = render_svg({'axiom': 'F', 'rules': {'F': 'F+F'}, 'generation': 1})
+    >>> r['status'], r['segments'], r['svg'].count('<path')
+    ('ok', 2, 1)
+    >>> render_svg({'axiom': 'F', 'rules': []})['error']
+    'TypeError: rules must be a non empty dict'
+    """
+    start = time.time()
+    result = {}
+    try:
+        stats = Stats()
+        # the file of the job is not written
+        job = dict(job, output=None)
+        plot = job_plot(job, stats)
+        svg = plot.draw().svg(job.get('size'))
+    except Exception, e:
+        result['status'] = 'error'
+        result['error'] = '%s: %s' % (e.__class__.__name__, e)
+    else:
+        result['status'] = 'ok'
+        result['svg'] = svg
+        for name in 'symbols', 'segments', 'instances':
+            if name in stats.counters:
+                result[name] = stats.counters[name]
+    result['time'] = time.time() - start
+    return result
+
+
+class _Pending:
+    """
+    result of a job in the pool, waited by all the identical requests
+
+    AsyncResult.get of python 2 wakes only one of the threads waiting
+    for it, an Event wakes them all.
+    """
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        # time of the submission to the pool
+        self.start = time.time()
+
+    def set(self, result):
+        """
+        set the result, if not set yet
+        """
+        if not self.event.is_set():
+            self.result = result
+            self.event.set()
+
+    def get(self, timeout=None):
+        """
+        Returns:
+            the result, None if not set after timeout seconds
+        """
+        self.event.wait(timeout)
+        return self.result
+
+
+class RenderService:
+    """
+    Render jobs with a pool of processes: identical jobs in progress are
+    rendered once, and the last rendered images are kept in a cache
+
+    >>> service = RenderService(processes=1, cache_size=2)
+    >>> job = {'axiom': 'F', 'rules': {'F': 'F[+F]F'}, 'generation': 5}
+    >>> threads = [threading.Thread(target=service.render, args=(job,)) for _ in range(4)]
+    >>> for t in threads: t.start()
+    >>> for t in threads: t.join()
+    >>> result, source = service.render(job)
+    >>> result['status'], source
+    ('ok', 'cache')
+    >>> s = service.stats()
+    >>> s['requests'], s['rendered'], s['coalesced'] + s['cache_hits'], s['in_flight']
+    (5, 1, 4, 0)
+    >>> service.close()
+
+    a request without result after the timeout gives up, not the
+    render: an identical request waits for it
+
+    >>> service = RenderService(processes=1, timeout=0.001)
+    >>> job = {'axiom': 'F', 'rules': {'F': 'F[+F]F[-F]F'}, 'angle': 25.7, 'generation': 6}
+    >>> result, source = service.render(job)
+    >>> result['status'], source, service.stats()['in_flight']
+    ('timeout', 'rendered', 1)
+    >>> service.render(job)[1]
+    'coalesced'
+    >>> service.close()
+    >>> s = service.stats()
+    >>> s['rendered'], s['timeouts'], s['in_flight']
+    (1, 2, 0)
+    """
+    def __init__(self, processes=None, cache_size=128, timeout=TIMEOUT,
+            max_generation=MAX_GENERATION, max_symbols=MAX_SYMBOLS, max_age=MAX_AGE):
+        """
+        Args:
+            processes: number of rendering processes, None for the
+                number of CPUs
+            cache_size: number of images in the cache
+            timeout: seconds a request waits for a render, None to wait
+                forever
+            max_generation, max_symbols: limits of the jobs, see
+                check_job
+            max_age: seconds after which a render without result is
+                lost, an identical request submits it again
+        """
+        self.pool = multiprocessing.Pool(processes)
+        self.cache_size = cache_size
+        self.timeout = timeout
+        self.max_age = max_age
+        self.max_generation = max_generation
+        self.max_symbols = max_symbols
+        self.lock = threading.Lock()
+        # key -> result, the last used at the end
+        self.cache = collections.OrderedDict()
+        # key -> _Pending of the jobs submitted to the pool, until their
+        # result or until they are lost
+        self.in_flight = {}
+        self.counters = dict.fromkeys(['requests', 'rendered', 'coalesced', 'cache_hits', 'errors',
+                'timeouts', 'lost'], 0)
+        self.latencies = collections.deque(maxlen=LATENCIES)
+
+    def render(self, job):
+        """
+        Returns:
+            (result, source) with result like render_svg, or with status
+            'timeout' or 'lost', and source one of 'rendered', 'coalesced' or
+            'cache'
+
+        Raises:
+            ValueError for a bad job or a job over the limits
+        """
+        start = time.time()
+        key = job_key(job)
+        check_job(job, self.max_generation, self.max_symbols)
+        with self.lock:
+            self.counters['requests'] += 1
+            result = self.cache.pop(key, None)
+            if result is not None:
+                self.counters['cache_hits'] += 1
+                self.cache[key] = result
+                source = 'cache'
+            else:
+                pending = self.in_flight.get(key)
+                if pending is not None and time.time() - pending.start > self.max_age:
+                    # its process died: the pool never gives its result
+                    del self.in_flight[key]
+                    self.counters['lost'] += 1
+                    pending.set({'status': 'lost', 'error': 'render lost after %s seconds' % self.max_age})
+                    pending = None
+                if pending is None:
+                    pending = self.in_flight[key] = _Pending()
+                    self.pool.apply_async(render_svg, (job,),
+                            callback=lambda result: self._rendered(key, pending, result))
+                    source = 'rendered'
+                else:
+                    self.counters['coalesced'] += 1
+                    source = 'coalesced'
+
+        if result is None:
+            result = pending.get(self.timeout)
+        if result is None:
+            # only this request gives up, the render goes on for the
+            # identical requests and the cache
+            result = {'status': 'timeout', 'error': 'no result after %s seconds' % self.timeout}
+
+        with self.lock:
+            if result['status'] == 'timeout':
+                self.counters['timeouts'] += 1
+            elif result['status'] != 'ok':
+                self.counters['errors'] += 1
+            self.latencies.append(time.time() - start)
+        return result, source
+
+    def _rendered(self, key, pending, result):
+        """
+        callback of the pool: cache the result and wake the requests,
+        unless the render was taken for lost
+        """
+        with self.lock:
+            if self.in_flight.get(key) is pending:
+                del self.in_flight[key]
+            self.counters['rendered'] += 1
+            if result['status'] == 'ok':
+                self.cache[key] = result
+                while len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+        pending.set(result)
+
+    def stats(self):
+        """
+        Returns:
+            dict of the counters, the queue and the latencies in seconds
+        """
+        with self.lock:
+            stats = dict(self.counters)
+            stats['in_flight'] = len(self.in_flight)
+            stats['cache_items'] = len(self.cache)
+            latencies = sorted(self.latencies)
+        if latencies:
+            n = len(latencies)
+            stats['latency'] = {
+                'count': n,
+                'mean': sum(latencies) / n,
+                'p50': latencies[n // 2],
+                'p95': latencies[min(n - 1, n * 95 // 100)],
+                'max': latencies[-1],
+            }
+        else:
+            stats['latency'] = {'count': 0}
+        return stats
+
+    def close(self):
+        """
+        stop the pool of processes, after the renders in progress; the
+        pool would wait forever for the lost ones, so it is terminated
+        if any
+        """
+        now = time.time()
+        with self.lock:
+            lost = self.counters['lost'] or any(now - p.start > self.max_age for p in self.in_flight.values())
+        if lost:
+            self.pool.terminate()
+        else:
+            self.pool.close()
+        self.pool.join()
+
+
+class RenderHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    POST /render and GET /stats of a RenderServer
+    """
+    def do_POST(self):
+        if self.path != '/render':
+            return self._send(404, 'application/json', json.dumps({'error': 'not found'}))
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            job = json.loads(self.rfile.read(length))
+            result, source = self.server.service.render(job)
+        except ValueError, e:
+            return self._send(400, 'application/json', json.dumps({'error': str(e)}))
+        if result['status'] == 'timeout':
+            return self._send(504, 'application/json', json.dumps({'error': result['error']}))
+        if result['status'] == 'lost':
+            return self._send(500, 'application/json', json.dumps({'error': result['error']}))
+        if result['status'] != 'ok':
+            return self._send(400, 'application/json', json.dumps({'error': result['error']}))
+        self._send(200, 'image/svg+xml', result['svg'], {'X-Pylsys-Source': source})
+
+    def do_GET(self):
+        if self.path != '/stats':
+            return self._send(404, 'application/json', json.dumps({'error': 'not found'}))
+        self._send(200, 'application/json', json.dumps(self.server.service.stats(), sort_keys=True))
+
+    def _send(self, code, content_type, body, headers=None):
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPServer.BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+class RenderServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    HTTP server of a RenderService, a thread by request
+
+    >>> import urllib2
+    >>> server = RenderServer(('localhost', 0), RenderService(processes=1))
+    >>> thread = threading.Thread(target=server.serve_forever)
+    >>> thread.start()
+    >>> url = 'http://localhost:%d' % server.server_address[1]
+    >>> job = json.dumps({'axiom': 'F', 'rules': {'F': 'F+F'}, 'size': [20, 20]})
+    >>> r = urllib2.urlopen(url + '/render', job)
+    >>> r.info()['Content-Type'], r.info()['X-Pylsys-Source']
+    ('image/svg+xml', 'rendered')
+    >>> print r.read().split('\\n')[1]
+    <svg xmlns="http://www.w3.org/2000/svg" width="20" height="20" viewBox="-1 -11 2 12">
+    >>> urllib2.urlopen(url + '/render', job).info()['X-Pylsys-Source']
+    'cache'
+    >>> urllib2.urlopen(url + '/render', '{"axiom": "F"}')
+    Traceback (most recent call last):
+        ...
+    HTTPError: HTTP Error 400: Bad Request
+    >>> stats = json.load(urllib2.urlopen(url + '/stats'))
+    >>> stats['requests'], stats['rendered'], stats['cache_hits'], stats['latency']['count']
+    (2, 1, 1, 2)
+    >>> server.shutdown()
+    >>> thread.join()
+    >>> server.close()
+    """
+    daemon_threads = True
+
+    def __init__(self, address, service, verbose=False):
+        BaseHTTPServer.HTTPServer.__init__(self, address, RenderHandler)
+        self.service = service
+        self.verbose = verbose
+
+    def close(self):
+        """
+        close the socket and stop the service
+        """
+        self.server_close()
+        self.service.close()
+
+
+def main(argv=None):
+    """
+    command line entry point
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(description='HTTP server rendering L-systems in SVG')
+    parser.add_argument('--host', default='localhost', help='address to listen (default: localhost)')
+    parser.add_argument('--port', type=int, default=8000, help='port to listen (default: 8000)')
+    parser.add_argument('-j', '--processes', type=int, default=None,
+            help='number of rendering processes (default: number of CPUs)')
+    parser.add_argument('--cache', type=int, default=128,
+            help='number of images in the cache (default: 128)')
+    parser.add_argument('--timeout', type=float, default=TIMEOUT,
+            help='seconds to wait for a render (default: %d)' % TIMEOUT)
+    parser.add_argument('--max-generation', type=int, default=MAX_GENERATION,
+            help='largest generation of a job (default: %d)' % MAX_GENERATION)
+    parser.add_argument('--max-symbols', type=int, default=MAX_SYMBOLS,
+            help='largest number of symbols of a job (default: %d)' % MAX_SYMBOLS)
+    parser.add_argument('--max-age', type=float, default=MAX_AGE,
+            help='seconds after which a render without result is lost (default: %d)' % MAX_AGE)
+    parser.add_argument('-v', '--verbose', action='store_true', help='log the requests')
+    args = parser.parse_args(argv)
+
+    service = RenderService(args.processes, args.cache, args.timeout, args.max_generation,
+            args.max_symbols, args.max_age)
+    server = RenderServer((args.host, args.port), service, args.verbose)
+    print 'serving on http://%s:%d' % server.server_address
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())